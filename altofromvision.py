@@ -1,229 +1,188 @@
+import hashlib
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import json
-import base64
-from xml.etree.ElementTree import Element, SubElement, tostring
+from typing import Iterable, Iterator
 
 import typer
 from typing_extensions import Annotated
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
+from anc_cli.alto import write_alto
+from anc_cli.ocr import VisionClient, annotate_files, response_cache
+from anc_cli.utils import encode_image, iter_pages, prefetch
+
 load_dotenv()
 APIKEY = os.environ.get("APIKEY")
 
 app = typer.Typer()
 
 
-def vision(file_path: str):
-    type_ = "DOCUMENT_TEXT_DETECTION"
-    image = Path(file_path).read_bytes()
-
-    image_content = base64.b64encode(image)
-    vservice = build("vision", "v1", developerKey=APIKEY)
-    language = "es"
-    request = vservice.images().annotate(
-        body={
-            "requests": [
-                {
-                    "image": {"content": image_content.decode("UTF-8")},
-                    "imageContext": {"languageHints": [language]},
-                    "features": [{"type": type_}],
-                }
-            ]
-        }
-    )
-    return request.execute(num_retries=3)
-
-
-def lines_from_paragraphs(response: dict):
-    lines = []
-    blocks = response["responses"][0]["fullTextAnnotation"]["pages"][0]["blocks"]
-    for block in blocks:
-        paragraphs = block["paragraphs"]
-        for paragraph in paragraphs:
-            paragraph_text = ""
-            for word in paragraph["words"]:
-                w = ""
-                for symbol in word["symbols"]:
-                    w += symbol["text"]
-                paragraph_text += w + " "
-
-            lines.append({"text": paragraph_text, "bbox": paragraph["boundingBox"]})
-    return lines
-
-
-def vision_to_alto(filename: str, response: json):
-    # Create the ALTO XML document
-    alto = Element(
-        "alto",
-        {
-            "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-            "xmlns": "http://www.loc.gov/standards/alto/ns-v4#",
-            "xsi:schemaLocation": "http://www.loc.gov/standards/alto/ns-v4# http://www.loc.gov/standards/alto/v4/alto-4-0.xsd",
-        },
-    )
-
-    # Add the Description element
-    description = SubElement(alto, "Description")
-    measurement_unit = SubElement(description, "MeasurementUnit")
-    measurement_unit.text = "pixel"
-    source_image_information = SubElement(description, "sourceImageInformation")
-    file_name = SubElement(source_image_information, "fileName")
-    file_name.text = filename
-
-    # Add the Tags element
-    tags = SubElement(alto, "Tags")
-    title = SubElement(
-        tags,
-        "OtherTag",
-        {"ID": "BT1", "LABEL": "Title", "DESCRIPTION": "block type Title"},
-    )
-    main = SubElement(
-        tags,
-        "OtherTag",
-        {"ID": "BT2", "LABEL": "Main", "DESCRIPTION": "block type Main"},
-    )
-    commentary = SubElement(
-        tags,
-        "OtherTag",
-        {"ID": "BT3", "LABEL": "Commentary", "DESCRIPTION": "block type Commentary"},
-    )
-    illustration = SubElement(
-        tags,
-        "OtherTag",
-        {
-            "ID": "BT4",
-            "LABEL": "Illustration",
-            "DESCRIPTION": "block type Illustration",
-        },
-    )
-    text = SubElement(
-        tags,
-        "OtherTag",
-        {"ID": "BT7", "LABEL": "text", "DESCRIPTION": "block type text"},
-    )
-    default = SubElement(
-        tags, "OtherTag", {"ID": "LT7", "LABEL": "default", "DESCRIPTION": "line type"}
-    )
-
-    # Add the layout information
-    layout = SubElement(alto, "Layout")
-    width = str(response["responses"][0]["fullTextAnnotation"]["pages"][0]["width"])
-    height = str(response["responses"][0]["fullTextAnnotation"]["pages"][0]["height"])
-    page = SubElement(
-        layout,
-        "Page",
-        {
-            "WIDTH": width,
-            "HEIGHT": height,
-            "PHYSICAL_IMG_NR": "0",
-            "ID": "eSc_dummypage_",
-        },
-    )
-    print_space = SubElement(
-        page, "PrintSpace", {"HPOS": "0", "VPOS": "0", "WIDTH": width, "HEIGHT": height}
-    )
-
-    # Add the text annotations as text blocks, text lines, and strings
-    # For each paragraph, add words
-    lines = lines_from_paragraphs(response)
-    for line in lines:
-        paragraph_text = line["text"]
-        paragraph_bbox = line["bbox"]
-        text_block = SubElement(
-            print_space,
-            "TextBlock",
-            {
-                "HPOS": str(paragraph_bbox["vertices"][0]["x"]),
-                "VPOS": str(paragraph_bbox["vertices"][0]["y"]),
-                "WIDTH": str(
-                    paragraph_bbox["vertices"][2]["x"]
-                    - paragraph_bbox["vertices"][0]["x"]
-                ),
-                "HEIGHT": str(
-                    paragraph_bbox["vertices"][2]["y"]
-                    - paragraph_bbox["vertices"][0]["y"]
-                ),
-                "ID": "text_block_1",
-            },
-        )
-        shape = SubElement(text_block, "Shape")
-        polygon = SubElement(
-            shape,
-            "Polygon",
-            {
-                "POINTS": " ".join(
-                    [
-                        f"{vertex['x']} {vertex['y']}"
-                        for vertex in paragraph_bbox["vertices"]
-                    ]
-                )
-            },
-        )
-        # generate line id
-        line_id = (
-            "line_"
-            + str(paragraph_bbox["vertices"][0]["x"])
-            + "_"
-            + str(paragraph_bbox["vertices"][0]["y"])
-        )
-        height_ = (
-            paragraph_bbox["vertices"][2]["y"] - paragraph_bbox["vertices"][0]["y"]
-        )
-
-        text_line = SubElement(
-            text_block,
-            "TextLine",
-            {
-                "ID": line_id,
-                "BASELINE": f"{paragraph_bbox['vertices'][0]['x']} {paragraph_bbox['vertices'][0]['y']+ height_} {paragraph_bbox['vertices'][2]['x']} {paragraph_bbox['vertices'][2]['y']}",
-                "HPOS": str(paragraph_bbox["vertices"][0]["x"]),
-                "VPOS": str(paragraph_bbox["vertices"][0]["y"]),
-                "WIDTH": str(
-                    paragraph_bbox["vertices"][2]["x"]
-                    - paragraph_bbox["vertices"][0]["x"]
-                ),
-                "HEIGHT": str(
-                    paragraph_bbox["vertices"][2]["y"]
-                    - paragraph_bbox["vertices"][0]["y"]
-                ),
-            },
-        )
-        string = SubElement(
-            text_line,
-            "String",
-            {
-                "CONTENT": paragraph_text,
-                "HPOS": str(paragraph_bbox["vertices"][0]["x"]),
-                "VPOS": str(paragraph_bbox["vertices"][0]["y"]),
-                "WIDTH": str(
-                    paragraph_bbox["vertices"][2]["x"]
-                    - paragraph_bbox["vertices"][0]["x"]
-                ),
-                "HEIGHT": str(
-                    paragraph_bbox["vertices"][2]["y"]
-                    - paragraph_bbox["vertices"][0]["y"]
-                ),
-            },
-        )
-
-    # Output the ALTO XML document
-    return tostring(alto, encoding="unicode")
+def pdf_responses(client: VisionClient, pdf: Path) -> Iterator[dict]:
+    """OCRs the pages of a PDF, rasterized a few at a time while earlier pages are OCR'd"""
+    images = prefetch((encode_image(image) for image in iter_pages(str(pdf))), 4)
+    return client.annotate_images(images, "es", "DOCUMENT_TEXT_DETECTION")
+
+
+class OCRError(Exception):
+    pass
+
+
+def response_error(response: dict):
+    """The error message of a Vision response that failed, or None"""
+    error = response["responses"][0].get("error")
+    if error is None:
+        return None
+    return error.get("message") or str(error)
+
+
+def checked(responses: Iterable[dict]) -> Iterator[dict]:
+    """Yields the responses, raising OCRError at the first one that failed"""
+    for page, response in enumerate(responses):
+        error = response_error(response)
+        if error is not None:
+            raise OCRError(f"page {page + 1}: {error}")
+        yield response
+
+
+def convert(name: str, responses: Iterable[dict], xml_path: Path) -> float:
+    """
+    Streams the ALTO of an image, or of every page of a PDF, to xml_path and returns the seconds it took.
+    The file is written under a temporary name, so an interrupted run, or a page Vision failed on
+    (OCRError), leaves no partial ALTO.
+    """
+    start = time.perf_counter()
+    tmp = xml_path.with_name(xml_path.name + ".tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            write_alto(f, name, checked(responses))
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, xml_path)
+    return time.perf_counter() - start
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def pending_images(images: list, outpath: Path, skip: str, manifest: dict) -> list:
+    """
+    (image, xml path, hash) of the images or PDFs whose ALTO is missing or out of date. With skip mtime, an
+    ALTO newer than its image is up to date; with hash, one made from an image with the same content.
+    """
+    pending = []
+    for image in images:
+        xml_path = outpath / f"{image.stem}.xml"
+        digest = None
+        if skip == "mtime":
+            if xml_path.exists() and xml_path.stat().st_mtime >= image.stat().st_mtime:
+                continue
+        elif skip == "hash":
+            digest = file_hash(image)
+            if xml_path.exists() and manifest.get(xml_path.name) == digest:
+                continue
+        pending.append((image, xml_path, digest))
+    return pending
+
+
+class counted:
+    """Iterates over an iterable, counting the items"""
+
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.n = 0
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.n += 1
+            yield item
 
 
 @app.command()
-def main(folder_path: Annotated[Path, typer.Argument()]):
+def main(folder_path: Annotated[Path, typer.Argument()],
+         workers: int = typer.Option(1, "--workers", help="Processes writing ALTO while the next images are OCR'd."),
+         skip: str = typer.Option("mtime", "--skip", help="Skip images whose ALTO is up to date by mtime or hash, none to convert all.")):
     if folder_path.exists():
         outpath = Path(folder_path / "alto")
         if not outpath.exists():
             outpath.mkdir(parents=True, exist_ok=True)
 
-        for image in folder_path.glob("**/*.jpg"):
-            response = vision(str(image))
-            xml = vision_to_alto(image.name, response)
-            # save to disk
-            (outpath / image.name.replace(".jpg", ".xml")).write_text(xml)
+        client = VisionClient(APIKEY, cache=response_cache())
+        # ALTO file name -> hash of the image it was made from, for --skip hash
+        manifest_path = outpath / "manifest.json"
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+        images = sorted(folder_path.glob("**/*.jpg"))
+        pending = pending_images(images, outpath, skip, manifest)
+        typer.echo(f"{len(images) - len(pending)} of {len(images)} images up to date, converting {len(pending)}")
+
+        start = time.perf_counter()
+        done = 0
+        failed = 0
+
+        def report(image, xml_path, digest, seconds):
+            nonlocal done
+            done += 1
+            if digest:
+                manifest[xml_path.name] = digest
+            elapsed = time.perf_counter() - start
+            typer.echo(f"{image.name}: ALTO in {seconds * 1000:.0f} ms, {done / elapsed:.1f} images/s")
+            if done % 100 == 0:
+                manifest_path.write_text(json.dumps(manifest))
+
+        def failures(responses):
+            """Reports the images Vision failed on and leaves them out, so they are OCR'd again next run"""
+            nonlocal failed
+            for (image, xml_path, digest), response in zip(pending, responses):
+                error = response_error(response)
+                if error is None:
+                    yield (image, xml_path, digest), response
+                else:
+                    failed += 1
+                    typer.echo(f"{image.name}: OCR failed, {error}", err=True)
+
+        # OCR requests stay in flight in the client's threads while responses are converted
+        responses = failures(annotate_files(client, (image for image, xml_path, digest in pending)))
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as pool:
+                queued = deque()
+                for (image, xml_path, digest), response in responses:
+                    queued.append((image, xml_path, digest, pool.submit(convert, image.name, [response], xml_path)))
+                    if len(queued) >= 2 * workers:
+                        image, xml_path, digest, future = queued.popleft()
+                        report(image, xml_path, digest, future.result())
+                while queued:
+                    image, xml_path, digest, future = queued.popleft()
+                    report(image, xml_path, digest, future.result())
+        else:
+            for (image, xml_path, digest), response in responses:
+                report(image, xml_path, digest, convert(image.name, [response], xml_path))
+        if done:
+            elapsed = time.perf_counter() - start
+            typer.echo(f"{done} images in {elapsed:.1f} s, {done / elapsed:.1f} images/s")
+        if failed:
+            typer.echo(f"OCR failed for {failed} images, no ALTO written for them", err=True)
+
+        # one multi-page ALTO per PDF, pages are OCR'd concurrently and streamed to the file
+        pdfs = sorted(folder_path.glob("**/*.pdf"))
+        for pdf, xml_path, digest in pending_images(pdfs, outpath, skip, manifest):
+            responses = counted(pdf_responses(client, pdf))
+            try:
+                seconds = convert(pdf.name, responses, xml_path)
+            except OCRError as e:
+                typer.echo(f"{pdf.name}: OCR failed on {e}, no ALTO written", err=True)
+                continue
+            if digest:
+                manifest[xml_path.name] = digest
+            typer.echo(f"{pdf.name}: {responses.n} pages in {seconds:.1f} s, {responses.n / seconds:.1f} pages/s")
+        if manifest:
+            manifest_path.write_text(json.dumps(manifest))
+        client.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+"""Streaming ALTO v4 writer for Vision fullTextAnnotation responses"""
+from io import StringIO
+from typing import Iterable, TextIO
+
+from anc_cli.geometry import word_text
+from anc_cli.layout import PageLayout, box, word_break
+
+ALTO_NAMESPACE = "http://www.loc.gov/standards/alto/ns-v4#"
+SCHEMA_LOCATION = "http://www.loc.gov/standards/alto/ns-v4# http://www.loc.gov/standards/alto/v4/alto-4-0.xsd"
+TAGS = [
+    ("BT1", "Title", "block type Title"),
+    ("BT2", "Main", "block type Main"),
+    ("BT3", "Commentary", "block type Commentary"),
+    ("BT4", "Illustration", "block type Illustration"),
+    ("BT7", "text", "block type text"),
+    ("LT7", "default", "line type"),
+]
+
+# characters escaped in text and attribute values
+ENTITIES = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "\n": "&#10;", "\t": "&#9;"})
+
+def attrs(attributes: dict) -> str:
+    if not attributes:
+        return ""
+    return "".join(f' {name}="{str(value).translate(ENTITIES)}"' for name, value in attributes.items())
+
+def position(b: tuple) -> dict:
+    return {"HPOS": str(b[0]), "VPOS": str(b[1]), "WIDTH": str(b[2] - b[0]), "HEIGHT": str(b[3] - b[1])}
+
+class AltoWriter:
+    """
+    Writes ALTO to an open text file one page at a time, nothing is kept in memory
+    once a page is written. Blocks of fullTextAnnotation become TextBlocks, the lines
+    of their paragraphs TextLines, and words Strings, with IDs unique in the file,
+    ex. p1_b2_l3_w4.
+
+        with open('volume.xml', 'w', encoding='utf-8') as f, AltoWriter(f, 'volume.pdf') as alto:
+            for response in responses:
+                alto.add_page(response)
+    """
+
+    def __init__(self, file: TextIO, filename: str):
+        self.write = file.write
+        self.n_pages = 0
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        self.start("alto", {"xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance", "xmlns": ALTO_NAMESPACE, "xsi:schemaLocation": SCHEMA_LOCATION})
+        self.start("Description")
+        self.element("MeasurementUnit", text="pixel")
+        self.start("sourceImageInformation")
+        self.element("fileName", text=filename)
+        self.end("sourceImageInformation")
+        self.end("Description")
+        self.start("Tags")
+        for id, label, description in TAGS:
+            self.element("OtherTag", {"ID": id, "LABEL": label, "DESCRIPTION": description})
+        self.end("Tags")
+        self.start("Layout")
+
+    def start(self, name: str, attributes: dict = None):
+        self.write(f"<{name}{attrs(attributes)}>")
+
+    def end(self, name: str):
+        self.write(f"</{name}>")
+
+    def element(self, name: str, attributes: dict = None, text: str = None):
+        if text is None:
+            self.write(f"<{name}{attrs(attributes)}/>")
+        else:
+            self.write(f"<{name}{attrs(attributes)}>{text.translate(ENTITIES)}</{name}>")
+
+    def add_page(self, response: dict):
+        """Writes one Vision response, {'responses': [response]} or the response itself, as a Page"""
+        layout = response if isinstance(response, PageLayout) else PageLayout(response)
+        self.n_pages += 1
+        p = self.n_pages
+        width, height = str(layout.width), str(layout.height)
+        self.start("Page", {"WIDTH": width, "HEIGHT": height, "PHYSICAL_IMG_NR": str(p), "ID": f"p{p}"})
+        self.start("PrintSpace", {"HPOS": "0", "VPOS": "0", "WIDTH": width, "HEIGHT": height})
+        # line boxes as (left, top, right, bottom) tuples of ints
+        lines = layout.lines
+        line_boxes = list(zip(lines.left.tolist(), lines.top.tolist(), lines.right.tolist(), lines.bottom.tolist()))
+        for b, (block_box, line_rows) in enumerate(layout.blocks, start=1):
+            attributes = position(block_box)
+            attributes["ID"] = f"p{p}_b{b}"
+            self.start("TextBlock", attributes)
+            for l, row in enumerate(line_rows, start=1):
+                self.add_line(f"p{p}_b{b}_l{l}", layout.line_words[row], line_boxes[row])
+            self.end("TextBlock")
+        self.end("PrintSpace")
+        self.end("Page")
+
+    def add_line(self, id: str, words: list, line: tuple):
+        boxes = [box(word.get("boundingBox") or {}) for word in words]
+        attributes = position(line)
+        attributes["ID"] = id
+        attributes["BASELINE"] = f"{line[0]} {line[3]} {line[2]} {line[3]}"
+        self.start("TextLine", attributes)
+        for n, (word, (left, top, right, bottom)) in enumerate(zip(words, boxes), start=1):
+            # Strings are written directly, they are most of the file
+            if n > 1:
+                self.write(f'<SP HPOS="{previous_right}" VPOS="{top}" WIDTH="{max(left - previous_right, 0)}"/>')
+            confidence = f' WC="{word["confidence"]:.2f}"' if "confidence" in word else ""
+            self.write(
+                f'<String ID="{id}_w{n}" CONTENT="{word_text(word).translate(ENTITIES)}" HPOS="{left}" VPOS="{top}"'
+                f' WIDTH="{right - left}" HEIGHT="{bottom - top}"{confidence}/>'
+            )
+            previous_right = right
+        if word_break(words[-1]) == "HYPHEN":
+            self.element("HYP", {"CONTENT": "-"})
+        self.end("TextLine")
+
+    def close(self):
+        self.end("Layout")
+        self.end("alto")
+        self.write("\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_alto(file: TextIO, filename: str, responses: Iterable[dict]) -> int:
+    """Writes the Vision responses of an image or of every page of a PDF as one ALTO file, returns the number of pages"""
+    with AltoWriter(file, filename) as alto:
+        for response in responses:
+            alto.add_page(response)
+    return alto.n_pages
+
+def vision_to_alto(filename: str, response: dict) -> str:
+    """ALTO of a single Vision response, as a string"""
+    output = StringIO()
+    write_alto(output, filename, [response])
+    return output.getvalue()
@@ -0,0 +1,79 @@
+"""Content-addressed cache of OCR responses"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+class ResponseCache:
+    """
+    Stores OCR responses on disk under the SHA-256 of the uploaded content and the
+    request options (feature type, language hint, processor...), so the same page is
+    never paid for twice. Entries are gzipped JSON. Once the cache is larger than
+    max_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, directory:str='anc_cli/cache/responses', max_bytes:int=2 * 1024 ** 3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = sum(f.stat().st_size for f in self.directory.glob('*/*.json.gz'))
+
+    @staticmethod
+    def key(content:bytes, *options:str) -> str:
+        sha = hashlib.sha256(content)
+        for option in options:
+            sha.update(b'\0' + str(option).encode('utf-8'))
+        return sha.hexdigest()
+
+    def path(self, key:str) -> Path:
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def get(self, key:str):
+        """The cached response, or None. A hit marks the entry as recently used."""
+        path = self.path(key)
+        try:
+            response = json.loads(gzip.decompress(path.read_bytes()))
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another thread or process since it was read
+            pass
+        return response
+
+    def put(self, key:str, response:dict):
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        content = gzip.compress(json.dumps(response).encode('utf-8'))
+        # write then rename, so readers never see a partial entry. Thread idents are only
+        # unique within a process, and several processes can share the cache
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(content)
+        with self.lock:
+            if path.exists():
+                self.size -= path.stat().st_size
+            os.replace(tmp, path)
+            self.size += len(content)
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is at 90% of max_bytes"""
+        entries = []
+        for path in self.directory.glob('*/*.json.gz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for mtime, size, path in entries:
+            if self.size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
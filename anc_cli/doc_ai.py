@@ -1,13 +1,20 @@
 #google-cloud-documentai-2.15.0
 from google.cloud import documentai_v1 as documentai
+from google.api_core import exceptions
 from google.api_core.client_options import ClientOptions
-from typing import List, Sequence
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Sequence, Tuple
+import hashlib
+import json
+import time
 from pathlib import Path 
-import spacy 
-from spaczz.matcher import FuzzyMatcher
 import pandas as pd
 import yaml 
 import numpy as np
+from anc_cli.cache import ResponseCache
+from anc_cli.extract import chunked
+from anc_cli.profiling import stats
 
 PROJECT_ID = "894403265340"
 LOCATION = "us"  # Format is 'us' or 'eu'
@@ -19,119 +26,326 @@ def get_table_data(
     rows: Sequence[documentai.Document.Page.Table.TableRow], text: str
 ) -> List[List[str]]:
     """
-    Get Text data from table rows
+    Get Text data from table rows, one list of cell texts per row
     """
-    all_values: List[List[str]] = []
-    for row in rows:
-        current_row_values: List[str] = []
-        for cell in row.cells:
-            current_row_values.append(
-                text_anchor_to_text(cell.layout.text_anchor, text)
-            )
-        all_values.append(current_row_values)
-    return all_values
+    return [[text_anchor_to_text(cell.layout.text_anchor, text) for cell in row.cells] for row in rows]
 
 def text_anchor_to_text(text_anchor: documentai.Document.TextAnchor, text: str) -> str:
     """
     Document AI identifies table data by their offsets in the entirity of the
     document's text. This function converts offsets to a string.
     """
-    response = ""
     # If a text segment spans several lines, it will
     # be stored in different text segments.
-    for segment in text_anchor.text_segments:
-        start_index = int(segment.start_index)
-        end_index = int(segment.end_index)
-        response += text[start_index:end_index]
+    response = "".join(text[int(segment.start_index):int(segment.end_index)] for segment in text_anchor.text_segments)
     return response.strip().replace("\n", " ")
 
-def pdf_to_data(file_path: str) -> List[List[str]]:
-    settings = yaml.load(Path('anc_cli/settings.yml').read_text(), Loader=yaml.Loader)
-    save_path = settings.get('save_path', None)
-    if not (Path.cwd() / save_path).exists():
-        (Path.cwd() / save_path).mkdir()
-    save_path = Path.cwd() / save_path
-
-    docai_client = documentai.DocumentProcessorServiceClient(
-            client_options=ClientOptions(
-                api_endpoint=f"{LOCATION}-documentai.googleapis.com"
-            )
-        )
+# errors worth retrying, anything else is raised straight away
+RETRY_ERRORS = (
+    exceptions.TooManyRequests,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+)
+
+def processor_client(location: str = LOCATION) -> documentai.DocumentProcessorServiceClient:
+    return documentai.DocumentProcessorServiceClient(
+        client_options=ClientOptions(api_endpoint=f"{location}-documentai.googleapis.com")
+    )
+
+def split_gcs_uri(uri: str) -> Tuple[str, str]:
+    """gs://bucket/some/prefix -> ('bucket', 'some/prefix'), raises ValueError for anything else"""
+    if not isinstance(uri, str) or not uri.startswith('gs://'):
+        raise ValueError(f"Not a gs://bucket/prefix URI: {uri!r}")
+    bucket, _, prefix = uri[len('gs://'):].partition('/')
+    if not bucket:
+        raise ValueError(f"No bucket in {uri!r}")
+    return bucket, prefix.strip('/')
+
+class DocAISubmitter:
+    """
+    Sends PDFs to a Document AI processor from a bounded pool of threads, sharing one client.
+    Failed calls are retried with exponential backoff. Each PDF is read only when it is
+    submitted, and results are yielded in input order as lists of Documents: one Document,
+    or the shards of a large document in batch mode.
+    With a ResponseCache, documents already processed by this processor are not sent again.
+    `client` and `storage_client` can be local stand-ins for testing.
+    """
+
+    def __init__(self, client=None, processor_name: str = None, max_in_flight: int = 4, retries: int = 3,
+                 backoff: float = 1.0, timeout: float = 300, cache: ResponseCache = None, force: bool = False,
+                 batch_timeout: float = 3600):
+        self.client = client or processor_client()
+        # The full resource name of the processor, e.g.:
+        # projects/project-id/locations/location/processor/processor-id
+        self.processor_name = processor_name or self.client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        # how long to wait for a whole batch request to finish, timeout is per call
+        self.batch_timeout = batch_timeout
+        self.cache = cache
+        # force: don't read from the cache, but still store the new results
+        self.force = force
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def call(self, method, request):
+        """Calls a client method, retrying RETRY_ERRORS"""
+        for attempt in range(self.retries + 1):
+            stats.count('docai_requests')
+            if attempt:
+                stats.count('retries')
+            try:
+                with stats.stage('docai.request'):
+                    return method(request=request, timeout=self.timeout)
+            except RETRY_ERRORS:
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def cache_key(self, content: bytes) -> str:
+        return self.cache.key(content, PROJECT_ID, PROCESSOR_ID, MIME_TYPE)
+
+    def cached(self, content: bytes):
+        """The cached Documents for a PDF, or None"""
+        if self.cache is None or self.force:
+            return None
+        cached = self.cache.get(self.cache_key(content))
+        if cached is None:
+            return None
+        shards = cached['shards'] if 'shards' in cached else [cached]
+        return [documentai.Document.from_json(json.dumps(shard), ignore_unknown_fields=True) for shard in shards]
 
-    # The full resource name of the processor, e.g.:
-    # projects/project-id/locations/location/processor/processor-id
-    # You must create new processors in the Cloud Console first
-    resource_name = docai_client.processor_path(PROJECT_ID, LOCATION, PROCESSOR_ID)
+    def store(self, content: bytes, documents: list):
+        if self.cache is None:
+            return
+        shards = [json.loads(documentai.Document.to_json(document)) for document in documents]
+        self.cache.put(self.cache_key(content), shards[0] if len(shards) == 1 else {'shards': shards})
 
-    # Read the file into memory
-    file_content = Path(file_path).read_bytes()
+    def process_file(self, path: Path) -> list:
+        """Processes one PDF with an online process_document request"""
+        file_content = Path(path).read_bytes()
+        documents = self.cached(file_content)
+        if documents is None:
+            stats.count('bytes_uploaded', len(file_content))
+            raw_document = documentai.RawDocument(content=file_content, mime_type=MIME_TYPE)
+            request = documentai.ProcessRequest(name=self.processor_name, raw_document=raw_document)
+            documents = [self.call(self.client.process_document, request).document]
+            self.store(file_content, documents)
+        return documents
 
-    # Load Binary Data into Document AI RawDocument Object
-    raw_document = documentai.RawDocument(content=file_content, mime_type=MIME_TYPE)
+    def ordered(self, function, items: Iterable) -> Iterator:
+        """Yields (item, function(item)) in order, with at most max_in_flight calls queued"""
+        pending = deque()
+        for item in items:
+            pending.append((item, self.executor.submit(function, item)))
+            if len(pending) >= self.max_in_flight:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
 
-    # Configure the process request
-    request = documentai.ProcessRequest(name=resource_name, raw_document=raw_document)
+    def process(self, paths: Iterable[Path]) -> Iterator[Tuple[Path, list]]:
+        """Yields (path, Documents) for each PDF, processed concurrently"""
+        return self.ordered(self.process_file, paths)
+
+    def process_batch(self, paths: list, storage_client, gcs_uri: str) -> list:
+        """
+        Processes PDFs with one batch_process_documents request: they are uploaded under
+        gcs_uri/input, and the results are read back from gcs_uri/output.
+        Returns the Documents of each path, in order.
+        """
+        bucket_name, prefix = split_gcs_uri(gcs_uri)
+        bucket = storage_client.bucket(bucket_name)
+        results = [None] * len(paths)
+        inputs = []
+        for i, path in enumerate(paths):
+            file_content = Path(path).read_bytes()
+            results[i] = self.cached(file_content)
+            if results[i] is None:
+                # named by content, so a PDF is uploaded once however often it is resubmitted
+                name = f"{prefix}/input/{hashlib.sha256(file_content).hexdigest()}.pdf"
+                with stats.stage('docai.upload'):
+                    bucket.blob(name).upload_from_filename(str(path), content_type=MIME_TYPE)
+                stats.count('bytes_uploaded', len(file_content))
+                inputs.append((i, file_content, f"gs://{bucket_name}/{name}"))
+        if not inputs:
+            return results
+        request = documentai.BatchProcessRequest(
+            name=self.processor_name,
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(
+                    documents=[documentai.GcsDocument(gcs_uri=uri, mime_type=MIME_TYPE) for i, content, uri in inputs]
+                )
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=f"gs://{bucket_name}/{prefix}/output/")
+            ),
+        )
+        operation = self.call(self.client.batch_process_documents, request)
+        with stats.stage('docai.batch_wait'):
+            operation.result(timeout=self.batch_timeout)
+        outputs = {status.input_gcs_source: status.output_gcs_destination for status in operation.metadata.individual_process_statuses}
+        for i, file_content, uri in inputs:
+            if uri not in outputs:
+                raise RuntimeError(f"Document AI returned no output for {paths[i]}")
+            output_bucket, output_prefix = split_gcs_uri(outputs[uri])
+            # the destination is .../<operation>/<index>, without the / .../1 would also list .../10
+            documents = [
+                documentai.Document.from_json(blob.download_as_bytes(), ignore_unknown_fields=True)
+                for blob in storage_client.list_blobs(output_bucket, prefix=f"{output_prefix}/")
+                if blob.name.endswith('.json')
+            ]
+            documents.sort(key=lambda document: document.shard_info.shard_index)
+            self.store(file_content, documents)
+            results[i] = documents
+        return results
 
-    # Use the Document AI client to process the sample form
-    result = docai_client.process_document(request=request)
+    def batch_process(self, paths: Iterable[Path], storage_client, gcs_uri: str, batch_size: int = 50) -> Iterator[Tuple[Path, list]]:
+        """Yields (path, Documents) for each PDF, batch_size PDFs per batch request, several batches at a time"""
+        batches = self.ordered(lambda batch: self.process_batch(batch, storage_client, gcs_uri), chunked(paths, batch_size))
+        for batch, results in batches:
+            yield from zip(batch, results)
+
+    def close(self):
+        self.executor.shutdown()
+
+def docai_submitter(settings: dict = None, cache: ResponseCache = None, force: bool = False) -> DocAISubmitter:
+    """DocAISubmitter configured from the `docai` section of settings.yml"""
+    docai = (settings or {}).get('docai') or {}
+    return DocAISubmitter(
+        max_in_flight=docai.get('max_in_flight', 4),
+        retries=docai.get('retries', 3),
+        timeout=docai.get('timeout', 300),
+        batch_timeout=docai.get('batch_timeout', 3600),
+        cache=cache,
+        force=force,
+    )
+
+def save_dir() -> Path:
+    """save_path from settings.yml, created if missing"""
+    settings = yaml.load(Path('anc_cli/settings.yml').read_text(), Loader=yaml.Loader)
+    save_path = Path.cwd() / settings.get('save_path', None)
+    if not save_path.exists():
+        save_path.mkdir()
+    return save_path
 
-    document = result.document
+def save_document(file_path: str, documents: list, save_path: Path = None) -> dict:
+    """
+    Saves the text and tables of a processed PDF to save_path, and returns them.
+    The tables of each shard are read against that shard's text.
+    """
+    save_path = save_path or save_dir()
     data = {}
     data['file'] = file_path
     save_file = str(file_path).split('.')[0].split('/')[-1]
-    data['text'] = document.text
-    (save_path / f'{save_file}_text.txt').write_text(document.text)
+    data['text'] = ''.join(document.text for document in documents)
+    (save_path / f'{save_file}_text.txt').write_text(data['text'])
     data['items'] = []
-    for page in document.pages:
-        for table in page.tables:
-            row = get_table_data(table.body_rows, document.text)
-            data['items'].append(row)
+    with stats.stage('docai.tables'):
+        for document in documents:
+            stats.count('pages', len(document.pages))
+            for page in document.pages:
+                for table in page.tables:
+                    # header rows are kept, a label in the header can have its value in the row below
+                    rows = get_table_data(list(table.header_rows) + list(table.body_rows), document.text)
+                    data['items'].append(rows)
+    # saved so that `ANC extract` can rerun matching without calling Document AI
+    (save_path / f'{save_file}_tables.json').write_text(json.dumps(dict(file=str(file_path), items=data['items']), ensure_ascii=False))
     return data
 
-# Flatten list using a recursive function
-def flatten(lst):
-    flattened = []
-    for i in lst:
-        if isinstance(i, list):
-            flattened.extend(flatten(i))
-        else:
-            flattened.append(i)
-    return flattened
-
-def process_data(data: List[dict], terms:list, match_ratio:int, term_matcher, place_matcher,language:str) -> List[dict]:
-    nlp = spacy.blank("es")
-    result = []
-    for i, page in enumerate(data):
-        f = page['file']
-        data = {}
-        data['file'] = str(f)
-        for term in terms:
-            data[term] = []
-        items = flatten(page['items'])
-        for ix, item in enumerate(items):
-            doc = nlp(item)
-            matches = term_matcher(doc)
-            term_match = [match_id for match_id, start, end, ratio in matches if ratio > match_ratio]
-            try:
-                doc = nlp(items[ix +1 ])
-                matches = place_matcher(doc)
-                place_match = [match_id for match_id, start, end, ratio in matches if ratio > match_ratio]
-                data[term_match[0].lower()].append(place_match[0].split('_')[1])
-                #print(term_match[0],'==', place_match[0])
-            except IndexError:
-                pass
-        for term in terms:
-            termz = list(set(data[term]))
-            if termz:
-                data[term] = list(set(data[term]))[0]
-        result.append(data)
+def pdf_to_data(file_path: str, cache: ResponseCache = None, force: bool = False, submitter: DocAISubmitter = None) -> dict:
+    """
+    Processes a PDF with Document AI and saves its text and tables to save_path.
+    With a ResponseCache, documents already processed by this processor are read
+    from the cache instead, unless force is set.
+    """
+    if submitter is None:
+        submitter = DocAISubmitter(cache=cache, force=force)
+    return save_document(file_path, submitter.process_file(file_path))
+
+def load_saved_data(save_path: Path) -> List[dict]:
+    """Reads back the text and tables saved by pdf_to_data, in the same form it returns"""
+    data = []
+    for tables_file in sorted(save_path.glob('*_tables.json')):
+        page = json.loads(tables_file.read_text())
+        text_file = tables_file.with_name(tables_file.name.replace('_tables.json', '_text.txt'))
+        page['text'] = text_file.read_text() if text_file.exists() else ''
+        data.append(page)
+    return data
+
+def adjacent_cells(tables: List[List[List[str]]]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Yields (cell, right, below) for each non-empty cell of the tables of a document: the next non-empty
+    cell to the right in the same row and the cell below in the same column, None if there is none.
+    """
+    for table in tables:
+        for r, row in enumerate(table):
+            for c, cell in enumerate(row):
+                if not cell:
+                    continue
+                right = next((value for value in row[c + 1:] if value), None)
+                below = (table[r + 1][c] or None) if r + 1 < len(table) and c < len(table[r + 1]) else None
+                yield cell, right, below
+
+def process_data(data: List[dict], registry) -> List[dict]:
+    """
+    Finds term/place pairs in the tables of each document, registry is a matchers.MatcherRegistry.
+    A cell matching a term is a label, its value is the adjacent cell (see adjacent_cells) and the first
+    place found in the values of a term is kept. Writes one row per document to save_path.
+    """
+    terms = registry.terms
+    # term labels are the upper cased terms
+    term_of = {term.upper(): term for term in terms}
+    with stats.stage('matching'):
+        result = _process_data(data, registry, terms, term_of)
+    stats.count('documents_extracted', len(data))
+    if not result:
+        return result
     df = pd.DataFrame(result)
-    settings = yaml.load(Path('anc_cli/settings.yml').read_text(), Loader=yaml.Loader)
-    save_path = settings.get('save_path', None)
-    if not (Path.cwd() / save_path).exists():
-        (Path.cwd() / save_path).mkdir()
-    save_path = Path.cwd() / save_path
-    save_file = data["file"].split('.')[0].split('/')[-1]
+    save_path = save_dir()
+    save_file = result[-1]["file"].split('.')[0].split('/')[-1]
     df = df.apply(lambda x: x.str.strip()).replace('[]', np.nan)
     df.to_csv(f'{str(save_path)}/{save_file}.csv', index=False)
-    return result
\ No newline at end of file
+    return result
+
+def _process_data(data: List[dict], registry, terms: list, term_of: dict) -> List[dict]:
+    result = []
+    pages = [list(adjacent_cells(page['items'])) for page in data]
+    # every distinct cell is tokenized once, in batches, and matched once as a label
+    cells = list(dict.fromkeys(cell for page in pages for cell, right, below in page))
+    with stats.stage('matching.tokenize'):
+        docs = registry.docs(cells)
+    with stats.stage('matching.classify'):
+        labels = {cell: registry.terms_in(docs[cell]) for cell in cells}
+    # the value of a label is the cell to its right or, in a row of labels or at the end of a row, the cell below
+    pairs = [
+        [(cell, right if right is not None and not labels[right] else below) for cell, right, below in page if labels[cell]]
+        for page in pages
+    ]
+    # then each value is matched once against the places
+    with stats.stage('matching.tokenize'):
+        values = registry.docs(value for page in pairs for cell, value in page if value is not None)
+    places = {}
+    with stats.stage('matching.places'):
+        for page, page_pairs in zip(data, pairs):
+            row = {}
+            row['file'] = str(page['file'])
+            for term in terms:
+                row[term] = []
+            for cell, value in page_pairs:
+                if value is None:
+                    continue
+                if value not in places:
+                    places[value] = [match_id for match_id, start, end, ratio in registry.places_in(values[value])]
+                if places[value]:
+                    stats.count('matches')
+                    row[term_of[labels[cell][0]]].append(places[value][0].split('_')[1])
+            for term in terms:
+                if row[term]:
+                    row[term] = row[term][0]
+            result.append(row)
+    return result
@@ -0,0 +1,270 @@
+"""Term and place extraction from Vision responses, page by page"""
+import csv
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+from anc_cli.matchers import MatcherRegistry
+from anc_cli.profiling import stats
+from anc_cli.store import CompactResponses, read_responses
+from anc_cli.utils import WordIndex, get_data_for_terms
+
+def chunked(iterable:Iterable, size:int) -> Iterator[list]:
+    """Lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def page_text(page:dict) -> str:
+    """Full text of a Vision response, the first textAnnotation"""
+    annotations = page['responses'][0].get('textAnnotations', [])
+    return annotations[0].get('description', '') if annotations else ''
+
+def place_name(match_id:str) -> str:
+    #ex. municipio_valle del cauca -> Valle del Cauca
+    return match_id.split("_")[1].title().replace('Del','del')
+
+# terms whose values are constrained by the gazetteer hierarchy
+DEPARTAMENTO_TERM = 'departamento'
+MUNICIPIO_TERM = 'municipio'
+
+def match_places(result:dict, docs:dict, registry, find_places=None) -> List[dict]:
+    """
+    Matches the value found next to a term, on its own and with its neighbouring words, against the places.
+    find_places defaults to registry.find_places.
+    """
+    match_ratio = registry.match_ratio
+    find_places = find_places or registry.find_places
+    output = []
+    token_matches = find_places(docs[result['value']])
+    span_matches = find_places(docs[context(result)])
+    for token_match, span_match in zip(token_matches, span_matches):
+        if token_match[3] > match_ratio or span_match[3] > match_ratio:
+            #ex. has span ('departamento_cauca', 0, 1, 100) ('departamento_valle del cauca', 0, 2, 75)
+            #ex. not span ('municipio_barranquilla', 0, 1, 100) ('departamento_atlántico', 0, 1, 89)
+            token_term = token_match[0].split("_")[0]
+            span_term = span_match[0].split("_")[0]
+            m = {}
+            if span_term == token_term:
+                m['match_term'] = span_term.title()
+                m['match_name'] = place_name(span_match[0])
+                m['ratio'] = span_match[3]
+            else:
+                m['match_term'] = token_term.title()
+                m['match_name'] = place_name(token_match[0])
+                m['ratio'] = token_match[3]
+            m['filename'] = result["filename"]
+            m['page'] = result["page"]
+            output.append(m)
+    return output
+
+def context(result:dict) -> str:
+    return f"{result['prior_word']} {result['value']} {result['next_word']}"
+
+def extract_pages(pages:List[dict], registry, difference:int=2, geometries:list=None) -> List[dict]:
+    """
+    Finds the pages that contain one of the terms, the values to the right of each term,
+    and the places those values match. Texts are tokenized in one batch for all pages.
+    When a page has a departamento, its municipio values are only matched against the
+    municipios of that departamento and tagged with it.
+    geometries, the PageGeometry of the words of each page, is given when pages only
+    have their full text, see extract_file.
+    Returns the matches in page order.
+    """
+    with stats.stage('matching'):
+        output = _extract_pages(pages, registry, difference, geometries or [None] * len(pages))
+    stats.count('pages_extracted', len(pages))
+    stats.count('matches', len(output))
+    return output
+
+def _extract_pages(pages:List[dict], registry, difference:int, geometries:list) -> List[dict]:
+    terms = registry.terms
+    with stats.stage('matching.classify'):
+        classified = registry.classify([page_text(p) for p in pages])
+        flagged = [(page, geometry) for page, geometry, (doc, terms_found) in zip(pages, geometries, classified) if terms_found]
+    stats.count('pages_flagged', len(flagged))
+    #For each term, find the results located just to the right in a given area.
+    # Allow Levenstein distance of 2 to account for OCR errors
+    with stats.stage('matching.get_data'):
+        page_results = [get_data_for_terms(page, terms, difference, WordIndex(page, geometry)) for page, geometry in flagged]
+    # tokenize every candidate value and its context in one batch
+    candidates = []
+    for results_by_term in page_results:
+        for results in results_by_term.values():
+            for result in results:
+                candidates.append(result['value'])
+                candidates.append(context(result))
+    with stats.stage('matching.tokenize'):
+        docs = registry.docs(candidates)
+    with stats.stage('matching.places'):
+        output = []
+        for results_by_term in page_results:
+            page_matches = {term: [] for term in terms}
+            # the departamento is resolved first, so the municipio is only looked for in that departamento
+            ordered = sorted(terms, key=lambda term: term != DEPARTAMENTO_TERM)
+            departamento = None
+            for term in ordered:
+                find_places = None
+                if term == MUNICIPIO_TERM and departamento:
+                    find_places = lambda doc: registry.find_municipios(doc, departamento)
+                for result in results_by_term[term]:
+                    page_matches[term].extend(match_places(result, docs, registry, find_places))
+                if term == DEPARTAMENTO_TERM:
+                    found = [m for m in page_matches[term] if m['match_term'] == 'Departamento']
+                    if found:
+                        departamento = max(found, key=lambda m: m['ratio'])['match_name']
+            if departamento:
+                for m in page_matches.get(MUNICIPIO_TERM, []):
+                    if m['match_term'] == 'Municipio':
+                        m['departamento'] = departamento
+            for term in terms:
+                output.extend(page_matches[term])
+    return output
+
+def extract_file(path:Path, registry, pages_per_batch:int=32) -> List[dict]:
+    """Matches for the pages of a saved Vision response file (JSON or compact), extracted pages_per_batch pages at a time"""
+    responses = read_responses(path)
+    if isinstance(responses, CompactResponses):
+        # word boxes are read straight from the memory-mapped arrays, without building word dicts
+        pages = ((responses.text_page(i), responses.geometry(i)) for i in range(len(responses)))
+    else:
+        pages = ((page, None) for page in responses)
+    matches = []
+    for batch in chunked(pages, pages_per_batch):
+        forms, geometries = zip(*batch)
+        matches.extend(extract_pages(list(forms), registry, geometries=list(geometries)))
+    return matches
+
+# matchers of a worker process, loaded once by init_worker
+worker_registry = None
+worker_pages_per_batch = 32
+
+def init_worker(language:str, terms:list, match_ratio:int, place_lookup:str, pages_per_batch:int, profile:bool=False):
+    global worker_registry, worker_pages_per_batch
+    worker_registry = MatcherRegistry(language, terms, match_ratio, place_lookup=place_lookup)
+    worker_pages_per_batch = pages_per_batch
+    if profile:
+        stats.enable()
+    # load spaCy and the matchers now rather than on the first file
+    worker_registry.nlp
+
+def extract_file_in_worker(path:Path) -> Tuple[List[dict], dict]:
+    """Matches of a file, and the worker's stats for it, merged into the main process's by extract_files"""
+    matches = extract_file(path, worker_registry, worker_pages_per_batch)
+    return matches, stats.snapshot()
+
+def worker_result(future) -> List[dict]:
+    matches, snapshot = future.result()
+    stats.merge(snapshot)
+    return matches
+
+def extract_files(paths:Iterable[Path], registry, workers:int=1, pages_per_batch:int=32) -> Iterator[Tuple[Path, List[dict]]]:
+    """
+    Yields (path, matches) for saved Vision response files, in the order of paths.
+    With workers > 1 files are extracted in a process pool, each worker loads the
+    matchers once, and at most 2 files per worker are queued at a time. Workers are
+    spawned, not forked, since the caller may have threads running (the Vision client,
+    prefetch) and the gazetteer cache is built here first so they only read it. Stage times
+    recorded in the workers are added to this process's stats, a cProfile of the
+    matching stage is only captured with workers=1.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield path, extract_file(path, registry, pages_per_batch)
+        return
+    registry.nlp
+    initargs = (registry.language, registry.terms, registry.match_ratio, registry.place_lookup, pages_per_batch, stats.enabled)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=initargs) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append((path, pool.submit(extract_file_in_worker, path)))
+            if len(pending) >= 2 * workers:
+                path, future = pending.popleft()
+                yield path, worker_result(future)
+        while pending:
+            path, future = pending.popleft()
+            yield path, worker_result(future)
+
+class FileCandidates:
+    """
+    Index of the places found in one file: match term -> place name -> candidate,
+    with the best ratio, the number of matches and the pages it was found on.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.n_matches = 0
+
+    def add(self, match:dict):
+        names = self.terms.setdefault(match['match_term'], {})
+        candidate = names.get(match['match_name'])
+        if candidate is None:
+            candidate = names[match['match_name']] = dict(name=match['match_name'], ratio=0, count=0, pages=[], order=self.n_matches)
+        candidate['ratio'] = max(candidate['ratio'], match.get('ratio', 0))
+        candidate['count'] += 1
+        if match['page'] not in candidate['pages']:
+            candidate['pages'].append(match['page'])
+        self.n_matches += 1
+
+    def first(self, term:str):
+        """The first place found for a term, the value process has always reported"""
+        names = self.terms.get(term.title(), {})
+        return min(names.values(), key=lambda c: c['order'])['name'] if names else None
+
+    def ranked(self, term:str) -> List[dict]:
+        """Candidates for a term, best ratio first, then most matches, then first found"""
+        names = self.terms.get(term.title(), {})
+        return sorted(names.values(), key=lambda c: (-c['ratio'], -c['count'], c['order']))
+
+class RowWriter:
+    """
+    Writes one CSV row per file, with the first place found for each term and, in
+    <term>_candidates, every place found ranked by ratio with the pages it is on.
+    Pages of a file arrive together, so a row is written as soon as the next file starts.
+    """
+
+    def __init__(self, path:str, terms:list):
+        self.terms = terms
+        self.file = open(path, 'w', newline='')
+        fieldnames = ['filename'] + terms + [f'{term}_candidates' for term in terms]
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        self.writer.writeheader()
+        self.filename = None
+        self.candidates = None
+
+    def add(self, match:dict):
+        if match['filename'] != self.filename:
+            self.flush()
+            self.filename = match['filename']
+            self.candidates = FileCandidates()
+        self.candidates.add(match)
+
+    def flush(self):
+        if self.candidates is not None:
+            row = {'filename': self.filename.split('/')[-1]}
+            for term in self.terms:
+                ranked = self.candidates.ranked(term)
+                if ranked:
+                    row[term] = self.candidates.first(term)
+                    #ex. Cauca (100, p. 0 2); Valle del Cauca (89, p. 1)
+                    row[f'{term}_candidates'] = '; '.join(f"{c['name']} ({c['ratio']}, p. {' '.join(map(str, c['pages']))})" for c in ranked)
+            self.writer.writerow(row)
+            self.file.flush()
+        self.candidates = None
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def write_jsonl(file, matches:List[dict]):
+    for match in matches:
+        file.write(json.dumps(match, ensure_ascii=False) + '\n')
+    file.flush()
@@ -0,0 +1,259 @@
+import hashlib
+import os
+import unicodedata
+from pathlib import Path
+import spacy
+import srsly
+from rapidfuzz import fuzz
+from spacy.tokens import DocBin
+from spacy.vocab import Vocab
+from spaczz.matcher import FuzzyMatcher
+
+# Bump when the layout of the cache file changes
+CACHE_VERSION = 3
+
+municipios_path = Path('anc_cli/data/municipios.json')
+departamentos_path = Path('anc_cli/data/departamentos.json')
+# departamento -> DANE code and municipios, municipios have no DANE codes
+hierarchy_path = Path('anc_cli/data/gazetteer.json')
+cache_dir = Path('anc_cli/cache')
+
+def data_key() -> str:
+    """Hash of the place data files the compiled gazetteer is built from"""
+    sha = hashlib.sha256()
+    sha.update(f"{CACHE_VERSION}:{spacy.__version__}".encode())
+    for path in (municipios_path, departamentos_path, hierarchy_path):
+        sha.update(path.read_bytes())
+    return sha.hexdigest()
+
+def gazetteer_key(nlp, terms:list) -> str:
+    """Hash of everything the compiled gazetteer is built from: the data files, the language and the terms"""
+    sha = hashlib.sha256(data_key().encode())
+    sha.update(nlp.lang.encode())
+    for term in sorted(terms):
+        sha.update(b'\0' + term.encode('utf-8'))
+    return sha.hexdigest()
+
+def build_gazetteer(nlp, terms:list) -> dict:
+    """Tokenizes every place name and term, returns the patterns and their docs"""
+    labels = []
+    texts = []
+    for municipio in srsly.read_json(municipios_path):
+        labels.append('municipio_' + municipio)
+        texts.append(municipio)
+    for departamento in srsly.read_json(departamentos_path):
+        labels.append('departamento_' + departamento)
+        texts.append(departamento)
+    for term in terms:
+        labels.append('term_' + term.upper())
+        texts.append(term)
+    docs = DocBin()
+    for doc in nlp.pipe(texts):
+        docs.add(doc)
+    hierarchy = {d['departamento']: d['municipios'] for d in srsly.read_json(hierarchy_path)}
+    dane = {d['departamento']: d['dane'] for d in srsly.read_json(hierarchy_path)}
+    return dict(labels=labels, normalized=[text.lower().strip() for text in texts], docs=docs.to_bytes(), hierarchy=hierarchy, dane=dane)
+
+def load_gazetteer(nlp, terms:list) -> dict:
+    """Reads the compiled gazetteer from the cache, building and saving it on a miss"""
+    # one file per term list, named after the data it is built from so stale files can be told apart
+    data = f"gazetteer-v{CACHE_VERSION}-{data_key()[:16]}"
+    key = gazetteer_key(nlp, terms)
+    cache_file = cache_dir / f"{data}-{key[:16]}.msgpack"
+    try:
+        gazetteer = srsly.read_msgpack(cache_file)
+        if gazetteer.get('key') == key:
+            return gazetteer
+    except (OSError, ValueError):
+        # missing, or not fully written: rebuild it
+        pass
+    gazetteer = build_gazetteer(nlp, terms)
+    gazetteer['key'] = key
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # write then rename, so other processes never read a partial file
+    tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    srsly.write_msgpack(tmp, gazetteer)
+    os.replace(tmp, cache_file)
+    # drop caches built from older data, those of other term lists are kept
+    for old in cache_dir.glob('gazetteer-*.msgpack'):
+        if not old.name.startswith(f"{data}-"):
+            old.unlink(missing_ok=True)
+    return gazetteer
+
+def load_matchers(language:str, terms:list):
+    """
+    Returns nlp, term_matcher and place_matcher, built from the cached gazetteer.
+    Term labels are the upper cased terms, place labels are municipio_<name> and departamento_<name>.
+    """
+    nlp = spacy.blank(language)
+    gazetteer = load_gazetteer(nlp, terms)
+    docs = DocBin().from_bytes(gazetteer['docs']).get_docs(nlp.vocab)
+    term_matcher = FuzzyMatcher(nlp.vocab)
+    place_matcher = FuzzyMatcher(nlp.vocab)
+    for label, doc in zip(gazetteer['labels'], docs):
+        if label.startswith('term_'):
+            term_matcher.add(label[len('term_'):], [doc])
+        else:
+            place_matcher.add(label, [doc])
+    return nlp, term_matcher, place_matcher
+
+def normalize(text:str) -> str:
+    """Casefolded, accent-stripped form used as the exact lookup key"""
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+def bigrams(text:str) -> set:
+    padded = f" {text} "
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+def place_order(match:tuple) -> tuple:
+    """
+    Sort key of place matches (match_id, start, end, ratio, ...): place_matcher's order, by start,
+    then longest, then best ratio, with ties, which place_matcher leaves in set order, by label
+    """
+    return match[1], match[1] - match[2], -match[3], match[0]
+
+def ratio(query:str, span, min_ratio:int) -> int:
+    """Ratio of a lower cased name and span as spaczz computes it, 0 below min_ratio"""
+    return round(fuzz.ratio(query, span.text.lower(), score_cutoff=min_ratio))
+
+def search(doc, query:str, size:int, min_ratio:int) -> list:
+    """
+    (start, end, ratio) of the spans of doc matching query, a name of size tokens, with the
+    search of spaczz's FuzzyMatcher at its default settings: spans of size tokens scoring at
+    least min_ratio / 1.5 have their boundaries moved by up to size // 2 tokens while the
+    ratio doesn't drop, the ones reaching min_ratio are kept, and overlapping spans are
+    dropped, best ratio first.
+    """
+    flex = size // 2
+    min_scan = round(min_ratio / 1.5) if flex else min_ratio
+    scanned = {}
+    for i in range(len(doc) - size + 1):
+        r = ratio(query, doc[i:i + size], min_scan)
+        if r:
+            scanned[i] = r
+    found = []
+    for pos, r in scanned.items():
+        left, best_left = pos, pos
+        right, best_right = pos + size, pos + size
+        if flex and r < 100:
+            best = r
+            for f in range(1, flex + 1):
+                # the same candidate spans, in the same order, as spaczz's PhraseSearcher._optimize
+                spans = []
+                if left - f >= 0:
+                    spans.append((left - f, right))
+                if left + f < right:
+                    spans.append((left + f, right))
+                if right - f > left:
+                    spans.append((left, right - f))
+                if right + f <= len(doc):
+                    spans.append((left, right + f))
+                if left - f >= 0 and right + f <= len(doc):
+                    spans.append((left - f, right + f))
+                if left + f < right and right - f > left:
+                    spans.append((left + f, right - f))
+                for start, end in spans:
+                    new = ratio(query, doc[start:end], best)
+                    if new:
+                        best, best_left, best_right = new, start, end
+                if best == r:
+                    break
+                r = best
+        if r >= min_ratio:
+            found.append((best_left, best_right, r))
+    kept = []
+    for start, end, r in sorted(found, key=lambda m: (-m[2], m[0])):
+        if all(end <= other[0] or start >= other[1] for other in kept):
+            kept.append((start, end, r))
+    return kept
+
+class PlaceResolver:
+    """
+    Place lookup returning the same matches as place_matcher, spaczz's FuzzyMatcher at its
+    default settings, in the same order, but cheaper: a doc is only searched for the names
+    sharing a bigram with its normalized (casefolded, accent-stripped) text and short
+    enough to reach min_ratio against it, instead of every name in the gazetteer. Strings
+    sharing no bigram, counting the spaces padding them, score below 67, so no match is lost.
+    """
+
+    def __init__(self, labels:list, min_ratio:int=75, hierarchy:dict=None, patterns:dict=None):
+        self.min_ratio = min_ratio
+        # normalized departamento -> municipio names, see for_departamento
+        self.hierarchy = {normalize(name): municipios for name, municipios in (hierarchy or {}).items()}
+        self.departamento_resolvers = {}
+        # a name listed twice is one label, as in place_matcher
+        self.labels = list(dict.fromkeys(labels))
+        # label -> (name, number of tokens), as place_matcher tokenized it when given
+        self.patterns = {}
+        for label in self.labels:
+            name = label.split('_', 1)[1]
+            self.patterns[label] = (patterns or {}).get(label) or (name, len(name.split()))
+        self.names = [self.patterns[label][0].lower() for label in self.labels]
+        self.buckets = {}
+        for i, name in enumerate(self.names):
+            for gram in bigrams(normalize(name)):
+                self.buckets.setdefault(gram, []).append(i)
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer:dict, min_ratio:int=75):
+        docs = DocBin().from_bytes(gazetteer['docs']).get_docs(Vocab())
+        patterns = {label: (doc.text, len(doc)) for label, doc in zip(gazetteer['labels'], docs) if not label.startswith('term_')}
+        return cls(list(patterns), min_ratio, gazetteer.get('hierarchy'), patterns)
+
+    def for_departamento(self, name:str):
+        """
+        Resolver over the municipios of one departamento, or None if the departamento
+        isn't in the hierarchy. name is matched like an exact lookup, ex. Atlántico or atlantico.
+        """
+        name = normalize(name)
+        if name not in self.hierarchy:
+            return None
+        if name not in self.departamento_resolvers:
+            labels = ['municipio_' + municipio for municipio in self.hierarchy[name]]
+            self.departamento_resolvers[name] = PlaceResolver(labels, self.min_ratio, patterns=self.patterns)
+        return self.departamento_resolvers[name]
+
+    def candidates(self, text:str, tokens:list=()) -> list:
+        """
+        Indexes of the names that can match text or a span of its tokens, in label order.
+        A span can start or end where text has no space, ex. the span Cali of "Cali,", so each token
+        is padded with spaces too.
+        """
+        # ratio = 200 * matches / (len(a) + len(b)), so a name can only reach
+        # min_ratio against a span of text if it is at most this long
+        max_length = len(text) * (200 - self.min_ratio) / self.min_ratio
+        grams = bigrams(normalize(text))
+        for token in tokens:
+            grams |= bigrams(normalize(token))
+        candidates = set()
+        for gram in grams:
+            candidates.update(self.buckets.get(gram, ()))
+        return sorted(i for i in candidates if len(self.names[i]) <= max_length)
+
+    def lookup(self, text:str) -> list:
+        """(label, ratio) of the places matching the whole text, best first"""
+        lowered = text.lower().strip()
+        matches = []
+        for i in self.candidates(lowered):
+            r = round(fuzz.ratio(lowered, self.names[i], score_cutoff=self.min_ratio))
+            if r:
+                matches.append((self.labels[i], r))
+        matches.sort(key=lambda m: -m[1])
+        return matches
+
+    def __call__(self, doc) -> list:
+        """
+        Matches of a Doc like place_matcher(doc): (match_id, start, end, ratio, name) with at most
+        one match of a label per token, in place_order.
+        """
+        matches = []
+        for i in self.candidates(doc.text, [token.text for token in doc]):
+            label = self.labels[i]
+            name, size = self.patterns[label]
+            if size > len(doc):
+                continue
+            for start, end, r in search(doc, self.names[i], size, self.min_ratio):
+                matches.append((label, start, end, r, name))
+        matches.sort(key=place_order)
+        return matches
@@ -0,0 +1,140 @@
+"""Bounding box geometry of a Vision response as NumPy arrays, with vectorized queries"""
+from typing import List
+import numpy as np
+
+def _vertices(poly:dict) -> tuple:
+    """x and y of the 4 vertices of a boundingPoly, Vision omits coordinates that are 0"""
+    vertices = (poly.get('vertices') or [])[:4]
+    vertices = vertices + [{}] * (4 - len(vertices))
+    return [v.get('x', 0) for v in vertices], [v.get('y', 0) for v in vertices]
+
+def word_text(word:dict) -> str:
+    return ''.join(symbol['text'] for symbol in word.get('symbols', []))
+
+class PageGeometry:
+    """
+    Boxes of the words (or paragraphs) of one page, loaded once into arrays:
+      x, y       (n, 4) int32, vertices in Vision order: upper left, upper right, lower right, lower left
+      ids        index of each box in its source list, ex. the textAnnotations index of a word
+      offsets    character offset of each box in the page text, -1 if it wasn't found
+      block      block number in fullTextAnnotation, -1 if unknown
+      paragraph  paragraph number in the page, -1 if unknown
+    Queries return ids, in page order unless noted, so results can be looked up
+    in the original response.
+    """
+
+    def __init__(self, texts:List[str], x, y, ids=None, offsets=None, block=None, paragraph=None):
+        n = len(texts)
+        self.texts = texts
+        self.x = np.asarray(x, dtype=np.int32).reshape(n, 4)
+        self.y = np.asarray(y, dtype=np.int32).reshape(n, 4)
+        self.ids = np.arange(n, dtype=np.int32) if ids is None else np.asarray(ids, dtype=np.int32)
+        unknown = np.full(n, -1, dtype=np.int32)
+        self.offsets = unknown if offsets is None else np.asarray(offsets, dtype=np.int32)
+        self.block = unknown if block is None else np.asarray(block, dtype=np.int32)
+        self.paragraph = unknown if paragraph is None else np.asarray(paragraph, dtype=np.int32)
+
+    @classmethod
+    def from_words(cls, form:dict):
+        """Words of textAnnotations (the full text annotation, id 0, is left out), with their paragraphs when Vision returned them"""
+        response = form['responses'][0]
+        annotations = response.get('textAnnotations', [])
+        words = annotations[1:]
+        texts = [word['description'] for word in words]
+        xs, ys = [], []
+        for word in words:
+            x, y = _vertices(word['boundingPoly'])
+            xs.append(x)
+            ys.append(y)
+        # textAnnotations only have the text, find each word in the full text, in order
+        full_text = annotations[0]['description'] if annotations else ''
+        offsets = []
+        position = 0
+        for text in texts:
+            offset = full_text.find(text, position)
+            if offset >= 0:
+                position = offset + len(text)
+            offsets.append(offset)
+        block = paragraph = None
+        # the words of fullTextAnnotation are the words of textAnnotations, in the same order
+        structure = [(b, p) for b, p, word in iter_words(response)]
+        if len(structure) == len(words):
+            block = [b for b, p in structure]
+            paragraph = [p for b, p in structure]
+        return cls(texts, xs, ys, ids=range(1, len(words) + 1), offsets=offsets, block=block, paragraph=paragraph)
+
+    @classmethod
+    def from_paragraphs(cls, response:dict):
+        """Paragraphs of fullTextAnnotation, each with the text of its words joined by spaces, see layout.PageLayout"""
+        from anc_cli.layout import PageLayout
+        return PageLayout(response).paragraphs
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def left(self):
+        return self.x[:, 0]
+
+    @property
+    def top(self):
+        return self.y[:, 0]
+
+    @property
+    def right(self):
+        return self.x[:, 2]
+
+    @property
+    def bottom(self):
+        return self.y[:, 2]
+
+    def _ids(self, mask) -> list:
+        return self.ids[mask].tolist()
+
+    def right_of(self, min_x:int, min_y:int, max_y:int) -> list:
+        """Boxes with upper left x > min_x and min_y < y < max_y, the search box of get_data"""
+        return self._ids((self.left > min_x) & (self.top > min_y) & (self.top < max_y))
+
+    def below(self, min_y:int, min_x:int=None) -> list:
+        """Boxes with upper left y > min_y and, if given, x > min_x"""
+        mask = self.top > min_y
+        if min_x is not None:
+            mask &= self.left > min_x
+        return self._ids(mask)
+
+    def within_band(self, min_y:int, max_y:int) -> list:
+        """Boxes overlapping the horizontal band min_y..max_y, left to right"""
+        mask = (self.top < max_y) & (self.bottom > min_y)
+        order = np.argsort(self.left[mask], kind='stable')
+        return self.ids[mask][order].tolist()
+
+    def nearest(self, x:int, y:int, ids:list=None):
+        """Id of the box whose upper left corner is closest to (x, y), among ids if given, or None"""
+        if ids is None:
+            candidates = np.arange(len(self))
+        else:
+            candidates = np.flatnonzero(np.isin(self.ids, ids))
+        if not len(candidates):
+            return None
+        distance = (self.left[candidates] - x) ** 2 + (self.top[candidates] - y) ** 2
+        return int(self.ids[candidates[np.argmin(distance)]])
+
+    def position(self, id:int) -> int:
+        """Row of a box in the arrays"""
+        return int(np.flatnonzero(self.ids == id)[0])
+
+def iter_paragraphs(response:dict):
+    """Yields (block number, paragraph) over the pages of fullTextAnnotation"""
+    full_text = response.get('fullTextAnnotation') or {}
+    n_block = 0
+    for page in full_text.get('pages', []):
+        for block in page.get('blocks', []):
+            for paragraph in block.get('paragraphs', []):
+                yield n_block, paragraph
+            n_block += 1
+
+def iter_words(response:dict):
+    """Yields (block number, paragraph number, word) over the pages of fullTextAnnotation"""
+    for n_paragraph, (n_block, paragraph) in enumerate(iter_paragraphs(response)):
+        for word in paragraph.get('words', []):
+            yield n_block, n_paragraph, word
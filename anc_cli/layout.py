@@ -0,0 +1,123 @@
+"""Page layout of a Vision fullTextAnnotation: blocks, paragraphs and lines, in reading order"""
+from typing import Dict, List
+import numpy as np
+
+from anc_cli.geometry import PageGeometry, word_text
+
+# detectedBreak types that end a line
+LINE_BREAKS = {"EOL_SURE_SPACE", "LINE_BREAK", "HYPHEN"}
+
+def box(poly: dict) -> tuple:
+    """(left, top, right, bottom) of a boundingBox, Vision omits coordinates that are 0"""
+    vertices = poly.get("vertices") or [{}]
+    xs = [v.get("x", 0) for v in vertices]
+    ys = [v.get("y", 0) for v in vertices]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def union(boxes: list) -> tuple:
+    return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+def word_break(word: dict) -> str:
+    """detectedBreak type after a word, from its last symbol"""
+    symbols = word.get("symbols") or [{}]
+    return ((symbols[-1].get("property") or {}).get("detectedBreak") or {}).get("type", "")
+
+def paragraph_lines(paragraph: dict) -> list:
+    """Splits the words of a paragraph into lines at the line breaks Vision detected"""
+    lines = [[]]
+    for word in paragraph.get("words", []):
+        lines[-1].append(word)
+        if word_break(word) in LINE_BREAKS:
+            lines.append([])
+    return [line for line in lines if line]
+
+def rectangle(b: tuple) -> tuple:
+    """x and y of the 4 vertices of a (left, top, right, bottom) box, in Vision order"""
+    left, top, right, bottom = b
+    return [left, right, right, left], [top, top, bottom, bottom]
+
+class PageLayout:
+    """
+    Blocks, paragraphs and lines of one Vision response, built once.
+      paragraphs  PageGeometry of the paragraphs, text is the words joined by spaces
+      lines       PageGeometry of the lines of each paragraph, split at detected line breaks
+      line_words  the word dicts of each line
+      blocks      (box, line rows) of each block, in Vision order
+      order       paragraph rows in reading order, top to bottom then left to right
+    next_fields finds the field after each of several labels in one pass.
+    """
+
+    def __init__(self, response: dict):
+        if "responses" in response:
+            response = response["responses"][0]
+        pages = (response.get("fullTextAnnotation") or {}).get("pages") or [{}]
+        self.width = pages[0].get("width", 0)
+        self.height = pages[0].get("height", 0)
+        self.blocks = []
+        self.line_words = []
+        paragraphs = dict(texts=[], xs=[], ys=[], block=[])
+        lines = dict(texts=[], xs=[], ys=[], block=[], paragraph=[])
+        for page in pages:
+            for block in page.get("blocks", []):
+                n_block = len(self.blocks)
+                line_rows = []
+                for paragraph in block.get("paragraphs", []):
+                    n_paragraph = len(paragraphs["texts"])
+                    words = [word_text(word) for word in paragraph.get("words", [])]
+                    x, y = rectangle(box(paragraph.get("boundingBox") or {}))
+                    paragraphs["texts"].append(" ".join(words) + " ")
+                    paragraphs["xs"].append(x)
+                    paragraphs["ys"].append(y)
+                    paragraphs["block"].append(n_block)
+                    for line in paragraph_lines(paragraph):
+                        line_rows.append(len(self.line_words))
+                        self.line_words.append(line)
+                        x, y = rectangle(union([box(word.get("boundingBox") or {}) for word in line]))
+                        lines["texts"].append(" ".join(word_text(word) for word in line))
+                        lines["xs"].append(x)
+                        lines["ys"].append(y)
+                        lines["block"].append(n_block)
+                        lines["paragraph"].append(n_paragraph)
+                self.blocks.append((box(block.get("boundingBox") or {}), line_rows))
+        offsets = np.cumsum([0] + [len(text) for text in paragraphs["texts"]])[:-1]
+        self.paragraphs = PageGeometry(paragraphs["texts"], paragraphs["xs"], paragraphs["ys"], offsets=offsets,
+                                       block=paragraphs["block"], paragraph=range(len(paragraphs["texts"])))
+        self.lines = PageGeometry(lines["texts"], lines["xs"], lines["ys"], block=lines["block"], paragraph=lines["paragraph"])
+        self.order = np.lexsort((self.paragraphs.left, self.paragraphs.top))
+        self.lowered = [text.lower() for text in self.paragraphs.texts]
+
+    def find(self, labels: List[str]) -> Dict[str, int]:
+        """Row of the first paragraph containing each label (case insensitive), in one pass over the paragraphs"""
+        remaining = {label: label.lower() for label in labels}
+        found = {}
+        for row, text in enumerate(self.lowered):
+            for label, lowered in list(remaining.items()):
+                if lowered in text:
+                    found[label] = row
+                    del remaining[label]
+            if not remaining:
+                break
+        return found
+
+    def after(self, row: int):
+        """Row of the first paragraph in reading order below and to the right of paragraph row, or None"""
+        tops = self.paragraphs.top[self.order]
+        start = np.searchsorted(tops, self.paragraphs.top[row], side="right")
+        candidates = self.order[start:]
+        right = self.paragraphs.left[candidates] > self.paragraphs.left[row]
+        if not right.any():
+            return None
+        return int(candidates[np.argmax(right)])
+
+    def next_fields(self, labels: List[str]) -> Dict[str, str]:
+        """
+        Text of the field after each label: the first paragraph below and to the right of the first
+        paragraph containing the label. None for labels not found or with nothing after them.
+        """
+        found = self.find(labels)
+        fields = {}
+        for label in labels:
+            row = found.get(label)
+            field = self.after(row) if row is not None else None
+            fields[label] = self.paragraphs.texts[field] if field is not None else None
+        return fields
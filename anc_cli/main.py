@@ -1,16 +1,16 @@
 import typer
 from pathlib import Path
-import pandas as pd 
 import srsly
 from anc_cli.utils import *
-import spacy
-from spacy.matcher import Matcher
-from spaczz.matcher import FuzzyMatcher
+from anc_cli.matchers import MatcherRegistry
+from anc_cli.extract import RowWriter, extract_files, write_jsonl
+from anc_cli.ocr import response_cache, vision_client
+from anc_cli.profiling import stats
+from anc_cli.store import remove_responses, response_stem, saved_response_files, write_compact
 from datetime import datetime
 now = datetime.now()
 import yaml
 from rich import print
-from .doc_ai import pdf_to_data, process_data
 
 #TODO 
 #1. back to FuzzMatcher
@@ -23,174 +23,169 @@ api_key = yaml.load(Path('anc_cli/apikey.yml').read_text(), Loader=yaml.Loader)
 api_key = api_key["APIKEY"]
 
 app = typer.Typer()
-nlp = spacy.blank(settings['language'])
-
-municipio_names = srsly.read_json('anc_cli/data/municipios.json')
-departamentos = srsly.read_json('anc_cli/data/departamentos.json')
-
-
-place_matcher = FuzzyMatcher(nlp.vocab)
-for municipio in municipio_names:
-  place_matcher.add('municipio_'+municipio, [nlp(municipio)])
-for departamento in departamentos:
-  place_matcher.add('departamento_'+departamento, [nlp(departamento)])
-
-#place_matcher = Matcher(nlp.vocab)
-# for municipio in municipio_names:
-#     pattern = [{"LOWER": {"FUZZY1": f"{m}"}} for m in nlp(municipio)]
-#     place_matcher.add('municipio_'+municipio, [pattern])
-# for departamento in departamentos:
-#     pattern = [{"LOWER": {"FUZZY1": f"{m}"}} for m in nlp(departamento)]
-#     place_matcher.add('departamento_'+departamento, [pattern])
 
 terms = settings['terms']
 match_ratio = settings['match_ratio']
 
-term_matcher = FuzzyMatcher(nlp.vocab)
-for term in terms:
-    term_matcher.add(term.upper(), [nlp(term)])
+# shared by process and docAI, loads spaCy and the cached gazetteer on first use
+registry = MatcherRegistry(settings['language'], terms, match_ratio, settings.get('n_process', 1), place_lookup=settings.get('place_lookup', 'tiered'))
 
 language = settings['language']
 output_dir = Path('anc_cli/output')
 if not output_dir.exists():
     output_dir.mkdir(parents=True, exist_ok=True)
-existing_data = [f.stem for f in output_dir.rglob("*")]
+
+def saved_responses() -> dict:
+    """PDF stem -> saved Vision responses in output_dir, which are written as <stem>_<i>.json or <stem>_<i>.meta.msgpack.gz"""
+    return {response_stem(f).rsplit('_', 1)[0]: f for f in saved_response_files(output_dir)}
+
+def save_responses(name:str, json_response:list) -> Path:
+    """Saves the Vision responses of a PDF in output_dir as name.json, or in the compact format if output_format is compact"""
+    if settings.get('output_format') == 'compact':
+        return write_compact(output_dir / name, json_response)
+    out_path = output_dir / f"{name}.json"
+    srsly.write_json(str(out_path), json_response)
+    return out_path
+
+def start_profile(profile:bool, profile_matching:bool):
+    """Starts recording stage times and counters, and a cProfile of the matching stage with profile_matching"""
+    if profile or profile_matching:
+        stats.enable()
+    if profile_matching:
+        stats.profile('matching')
+
+def write_profile(command:str):
+    """Writes profile-<command>-<date>.json and .csv (and .prof) if profiling was started"""
+    if not stats.enabled:
+        return
+    date_time = now.strftime("%Y-%m-%d-%H:%M:%S")
+    for path in stats.write(f'profile-{command}-{date_time}'):
+        typer.echo(f"Profile written to {path}")
+
+def ocr_files(pdf_directory:Path, client, force:bool=False):
+    """
+    OCRs every PDF in pdf_directory and yields the path of its saved Vision responses, one file at a time.
+    Responses already saved in output_dir are reused unless force is set.
+    """
+    existing_data = saved_responses()
+    for i, file_ in enumerate(pdf_directory.rglob("*")):
+        if file_.suffix == '.pdf' and file_.stem in existing_data and not force:
+            yield existing_data[file_.stem]
+        elif file_.suffix == '.pdf':
+            typer.echo(f"OCR {file_}")
+            with stats.stage('ocr'):
+                json_response = pdf_to_data(file_, language, api_key, client, settings.get('ocr', {}).get('pages_per_chunk', 4), settings.get('encoding'))
+            stats.count('pdfs_ocr')
+            previous = existing_data.get(file_.stem)
+            with stats.stage('save'):
+                out_path = save_responses(response_stem(previous) if previous else f"{file_.stem}_{i}", json_response)
+            if previous and previous != out_path:
+                remove_responses(previous)
+            yield out_path
+
+def write_output(paths, workers:int):
+    """
+    Extracts matches from saved Vision responses and appends them to the output files
+    as each file is done: matches to output-<date>.jsonl, one row per file to output-<date>.csv
+    """
+    date_time = now.strftime("%Y-%m-%d-%H:%M:%S")
+    rows = RowWriter(f'output-{date_time}.csv', terms)
+    with open(f'output-{date_time}.jsonl', 'w') as matches_file:
+        for path, matches in extract_files(paths, registry, workers, settings.get('pages_per_batch', 32)):
+            typer.echo(f"{path.name}: {len(matches)} matches")
+            write_jsonl(matches_file, matches)
+            for match in matches:
+                rows.add(match)
+    rows.close()
 
 @app.command()
-def process(pdf_directory:str, force: bool = typer.Option(False, "--force", help='Ignore existing data and create new.')):
+def process(pdf_directory:str, force: bool = typer.Option(False, "--force", help='Ignore existing data and the OCR cache, and create new.'),
+            workers: int = typer.Option(1, "--workers", help='Processes used to extract terms and places.'),
+            profile: bool = typer.Option(False, "--profile", help='Write the time spent in each stage, and counters, to profile-<command>-<date>.json and .csv.'),
+            profile_matching: bool = typer.Option(False, "--profile-matching", help='Also write a cProfile of the matching stage to a .prof file.')):
     pdf_directory = Path(pdf_directory)
     if pdf_directory.exists():
         print(f"[green] Processing {len(list(pdf_directory.rglob('*')))} files [/green]")
 
-        data = []
-        for i, file_ in enumerate(pdf_directory.rglob("*")):
-            if file_.suffix == '.pdf' and file_.stem not in existing_data:
-                json_response = pdf_to_data(file_, language, api_key)
-                out_path = str((output_dir / f"{file_.stem}_{i}.json"))
-                srsly.write_json(out_path, json_response)
-                data.extend(json_response)
-            elif file_.suffix == '.pdf' and file_.stem not in existing_data and force:
-                typer.echo(f"Processing {len(data)} pages")
-
-
-        doc_w_term = []
-        doc_places = {}
-        output = []
-        if data:
-            for index, page in enumerate(data):
-                typer.echo(f"Processing page {index + 1} of {len(data)}")
-                for response in page['responses']:
-                    for i, annotation in enumerate(response['textAnnotations']):
-                        if i == 0:
-                            # Process full text of document, identify pages that contain relevant terms
-                            full_text = annotation.get('description', None)
-                            doc = nlp(full_text)
-                            # term_matcher = Matcher(nlp.vocab)
-                            # for term in terms:
-                            #     pattern = [{"LOWER": {"FUZZY1": f"{m}"}} for m in nlp(term)]
-                            term_matcher = FuzzyMatcher(nlp.vocab)
-                            #term_matcher.add(term, [pattern])
-                            for term in terms:
-                                term_matcher.add(term.upper(), [nlp(term)])
-                            matches = term_matcher(doc)
-                            #terms_found = [match_id for match_id, start, end in matches]
-                            terms_found = [match_id for match_id, start, end, ratio in matches if ratio > match_ratio]
-
-                        if terms_found:
-                            doc_w_term.append(i)
-                            matches = place_matcher(doc)
-                            spans = [doc[start:end] for match_id, start, end, ratio in matches if ratio > match_ratio]
-                            match_ids = [match_id for match_id, start, end, ratio in matches if ratio > match_ratio]
-                            doc_places[i] = [dict(index=i,start=span.start_char, end=span.end_char, text=span.text, match_id=match_id) for span, match_id in zip(spacy.util.filter_spans(spans), match_ids)]
-           
-                            # matches = place_matcher(doc)
-                            # spans = [doc[start:end] for match_id, start, end in matches]
-                            # match_ids = [match_id for match_id, start, end in matches]
-                            # doc_places[i] = [dict(index=i,start=span.start_char, end=span.end_char, text=span.text, match_id=match_id) for span, match_id in zip(spacy.util.filter_spans(spans), match_ids)]
-                        
-                    
-            if doc_w_term: 
-                for i, d in enumerate(data):
-                    if i in doc_w_term:
-                        for term in terms:
-                            #For a given term, find the results located just to the right in a given area. 
-                            # Allow Levenstein distance of 2 to account for OCR errors
-                            results = get_data(d, term, 2)
-                            for result in results:  
-                                match_term = result['key'] #ex. DEPARTAMENTO
-                                doc = nlp(result['value']) 
-                                token_matches = place_matcher(doc)
-                                doc = nlp(f"{result['prior_word']} {result['value']} {result['next_word']}")
-                                span_matches = place_matcher(doc)
-                                for token_match, span_match in zip(token_matches, span_matches):
-                                    if token_match[3] > match_ratio or span_match[3] > match_ratio:
-                                        #ex. has span ('departamento_cauca', 0, 1, 100) ('departamento_valle del cauca', 0, 2, 75)
-                                        #ex. not span ('municipio_barranquilla', 0, 1, 100) ('departamento_atlántico', 0, 1, 89)
-                                        token_term = token_match[0].split("_")[0]
-                                        span_term = span_match[0].split("_")[0]
-                                        m = {}
-                                        if span_term == token_term:
-                                            m['match_term'] = span_term.title()
-                                            m['match_name'] = span_match[0].split("_")[1].title().replace('Del','del')
-                                        else:
-                                            m['match_term'] = token_term.title()
-                                            m['match_name'] = token_match[0].split("_")[1].title().replace('Del','del')
-                                        m['filename'] = result["filename"]
-                                        m['page'] = result["page"]
-                                        output.append(m)
-                                # for token_match, span_match in zip(token_matches, span_matches):
-                                    
-                                #     #ex. has span ('departamento_cauca', 0, 1, 100) ('departamento_valle del cauca', 0, 2, 75)
-                                #     #ex. not span ('municipio_barranquilla', 0, 1, 100) ('departamento_atlántico', 0, 1, 89)
-                                #     string_id = nlp.vocab.strings[token_match[0]]
-                                #     token_term = string_id.split("_")[0]
-
-                                #     string_id = nlp.vocab.strings[span_match[0]]
-                                #     span_term = string_id.split("_")[0]
-                                #     m = {}
-                                #     if span_term == token_term:
-                                #         m['match_term'] = span_term.title()
-                                #         string_id = nlp.vocab.strings[span_match[0]]
-                                #         m['match_name'] = string_id.split("_")[1].title().replace('Del','del')
-                                #     else:
-                                #         m['match_term'] = token_term.title()
-                                #         string_id = nlp.vocab.strings[token_match[0]]
-                                #         m['match_name'] = string_id.split("_")[1].title().replace('Del','del')
-                                # m['filename'] = result["filename"]
-                                # m['page'] = result["page"]
-                                # output.append(m)
-                                
-            if output:
-                
-                data = []
-                filenames = [e['filename'] for e in output]
-                for filename in set(filenames):
-                    row = {}
-                    row['filename'] = filename.split('/')[-1]
-                    for term in terms:
-                        d = [d['match_name'] for d in output if d["match_term"] == term.title() and d['filename'] == filename]
-                        
-                        if d:
-                            row[term] = d[0]        
-                    data.append(row)        
-                # TODO before DataFrame create rows for pairs of Muni/Depart
-                df = pd.DataFrame(data)
-                date_time = now.strftime("%Y-%m-%d-%H:%M:%S")
-                df.to_csv(f'output-{date_time}.csv', index=False)
+        # one client, and its connections, for the whole run. --force re-OCRs pages found in the cache
+        client = vision_client(api_key, settings, force=force)
+        # Each PDF flows through OCR -> classify -> extract -> output,
+        # matches and rows are appended to the output files as they are found.
+        start_profile(profile, profile_matching)
+        write_output(ocr_files(pdf_directory, client, force), workers)
+        write_profile('process')
 
     else:
         typer.echo("Not a valid path, please check and try again.")
 
 @app.command()
-def docAI(pdf_directory:str):
-    data = []
+def docAI(pdf_directory:str, force: bool = typer.Option(False, "--force", help='Ignore the Document AI cache and process again.'),
+          batch: bool = typer.Option(False, "--batch", help='Submit the PDFs in batch requests through Cloud Storage, see docai in settings.yml.'),
+          profile: bool = typer.Option(False, "--profile", help='Write the time spent in each stage, and counters, to profile-<command>-<date>.json and .csv.'),
+          profile_matching: bool = typer.Option(False, "--profile-matching", help='Also write a cProfile of the matching stage to a .prof file.')):
+    from .doc_ai import docai_submitter, process_data, save_document, split_gcs_uri
+    docai = settings.get('docai') or {}
+    if batch:
+        # checked before any PDF is sent, a blank or malformed URI would only fail in the first batch
+        try:
+            split_gcs_uri(docai.get('gcs_uri'))
+        except ValueError:
+            typer.echo(f"docAI --batch needs docai.gcs_uri in settings.yml, ex. gs://bucket/prefix, got {docai.get('gcs_uri')!r}")
+            raise typer.Exit(1)
+    start_profile(profile, profile_matching)
+    # one client for the whole run, PDFs are sent concurrently
+    submitter = docai_submitter(settings, response_cache(settings), force)
     if Path(pdf_directory).is_dir():
-        for pdf in Path(pdf_directory).glob('*.pdf'):
-            typer.echo(f"Processing {pdf}")
-            pdf_data = pdf_to_data(pdf)
-            data.append(pdf_data)
+        pdfs = sorted(Path(pdf_directory).glob('*.pdf'))
+    else:
+        pdfs = [Path(pdf_directory)]
+    if batch:
+        from google.cloud import storage
+        results = submitter.batch_process(pdfs, storage.Client(), docai['gcs_uri'], docai.get('batch_size', 50))
     else:
-        pdf_data = pdf_to_data(pdf_directory)
-        data.append(pdf_data)
-    process_data(data, terms, match_ratio, term_matcher, place_matcher, language)
+        results = submitter.process(pdfs)
+    data = []
+    for pdf, documents in results:
+        typer.echo(f"Processed {pdf}")
+        data.append(save_document(pdf, documents))
+    submitter.close()
+    process_data(data, registry)
+    write_profile('docAI')
     
+
+@app.command()
+def extract(workers: int = typer.Option(1, "--workers", help='Processes used to extract terms and places.'),
+            vision: bool = typer.Option(True, help='Use the Vision responses saved by process.'),
+            docai: bool = typer.Option(True, help='Use the text and tables saved by docAI.'),
+            profile: bool = typer.Option(False, "--profile", help='Write the time spent in each stage, and counters, to profile-<command>-<date>.json and .csv.'),
+            profile_matching: bool = typer.Option(False, "--profile-matching", help='Also write a cProfile of the matching stage to a .prof file.')):
+    """Rerun term and place extraction on saved OCR output, after changing terms or match_ratio, without calling any API."""
+    start_profile(profile, profile_matching)
+    if vision:
+        paths = saved_response_files(output_dir)
+        typer.echo(f"Extracting from {len(paths)} saved Vision responses")
+        if paths:
+            write_output(paths, workers)
+    if docai:
+        from .doc_ai import load_saved_data, process_data
+        data = load_saved_data(Path.cwd() / settings.get('save_path', 'anc_data/'))
+        typer.echo(f"Extracting from {len(data)} saved Document AI results")
+        if data:
+            process_data(data, registry)
+    write_profile('extract')
+
+@app.command()
+def compact(keep_json: bool = typer.Option(False, "--keep-json", help='Keep the JSON files after converting them.')):
+    """Convert the Vision responses saved as JSON in the output folder to the compact format."""
+    paths = sorted(output_dir.rglob("*.json"))
+    typer.echo(f"Converting {len(paths)} saved Vision responses")
+    saved = 0
+    for path in paths:
+        write_compact(path.with_suffix(''), srsly.read_json(path))
+        size = path.stat().st_size
+        new_size = sum(f.stat().st_size for f in path.parent.glob(f"{path.stem}.*") if f != path)
+        saved += size - new_size
+        typer.echo(f"{path.name}: {size // 1024} KB -> {new_size // 1024} KB")
+        if not keep_json:
+            path.unlink()
+    typer.echo(f"Saved {saved / 1024 ** 2:.1f} MB")
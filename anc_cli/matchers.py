@@ -0,0 +1,112 @@
+import warnings
+from typing import Dict, Iterable, List
+
+
+class MatcherRegistry:
+    """
+    Owns the spaCy pipeline, term_matcher and place_matcher shared by `process` and `docAI`.
+    Nothing is loaded until a matcher is first used, so commands that don't need spaCy start fast.
+    """
+
+    def __init__(self, language:str, terms:list, match_ratio:int, n_process:int=1, batch_size:int=64, max_cached_docs:int=100000,
+                 place_lookup:str='tiered'):
+        self.language = language
+        # 'tiered' resolves places with gazetteer.PlaceResolver, 'fuzzy' with spaczz's place_matcher
+        self.place_lookup = place_lookup
+        self._resolver = None
+        # find_municipios warns once that fuzzy ignores the departamento
+        self._warned_departamento = False
+        self.terms = terms
+        self.match_ratio = match_ratio
+        self.n_process = n_process
+        self.batch_size = batch_size
+        self.max_cached_docs = max_cached_docs
+        self._loaded = None
+        # text -> Doc, every distinct string is tokenized once per run
+        self._docs = {}
+
+    def _load(self):
+        if self._loaded is None:
+            from .gazetteer import load_matchers
+            self._loaded = load_matchers(self.language, self.terms)
+        return self._loaded
+
+    @property
+    def nlp(self):
+        return self._load()[0]
+
+    @property
+    def term_matcher(self):
+        return self._load()[1]
+
+    @property
+    def place_matcher(self):
+        return self._load()[2]
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            from .gazetteer import PlaceResolver, load_gazetteer
+            self._resolver = PlaceResolver.from_gazetteer(load_gazetteer(self.nlp, self.terms))
+        return self._resolver
+
+    def find_places(self, doc) -> list:
+        """
+        All place matches (match_id, start, end, ratio, ...) in a doc, with the configured place_lookup.
+        Both lookups give the same matches in the same order, see gazetteer.place_order.
+        """
+        if self.place_lookup == 'tiered':
+            return self.resolver(doc)
+        from .gazetteer import place_order
+        return sorted(self.place_matcher(doc), key=place_order)
+
+    def find_municipios(self, doc, departamento:str=None) -> list:
+        """
+        Like find_places, but once the departamento of a form is known, only that
+        departamento's municipios are scored. Needs place_lookup tiered: with fuzzy the
+        departamento is ignored, with a warning on the first call, and every place is matched.
+        """
+        if departamento and self.place_lookup == 'tiered':
+            resolver = self.resolver.for_departamento(departamento)
+            if resolver is not None:
+                return resolver(doc)
+        elif departamento and not self._warned_departamento:
+            self._warned_departamento = True
+            warnings.warn("place_lookup fuzzy matches municipios of every departamento, set place_lookup: tiered to match those of the departamento found on the page")
+        return self.find_places(doc)
+
+    def terms_in(self, doc) -> List[str]:
+        """Term labels (upper cased terms) found in a doc with a ratio above match_ratio"""
+        return [match_id for match_id, start, end, ratio, *_ in self.term_matcher(doc) if ratio > self.match_ratio]
+
+    def places_in(self, doc) -> list:
+        """place_matcher matches (match_id, start, end, ratio) above match_ratio"""
+        return [(match_id, start, end, ratio) for match_id, start, end, ratio, *_ in self.find_places(doc) if ratio > self.match_ratio]
+
+    def docs(self, texts:Iterable[str]) -> Dict[str, object]:
+        """
+        Tokenizes the texts not seen before in batches with nlp.pipe and
+        returns the text -> Doc cache, which is reused for the rest of the run.
+        """
+        texts = list(dict.fromkeys(texts))
+        new = [text for text in texts if text not in self._docs]
+        if new:
+            # keep memory flat on long runs, only the docs asked for now are kept
+            if len(self._docs) + len(new) > self.max_cached_docs:
+                self._docs = {text: self._docs[text] for text in texts if text in self._docs}
+            docs = self.nlp.pipe(new, batch_size=self.batch_size, n_process=self.n_process)
+            self._docs.update(zip(new, docs))
+        return self._docs
+
+    def doc(self, text:str):
+        """The cached Doc for a text, tokenizing it if it wasn't batched beforehand"""
+        return self.docs([text])[text]
+
+    def classify(self, texts:List[str]) -> list:
+        """
+        Tokenizes many texts at once with nlp.pipe and runs term_matcher on each.
+        Returns a list of (doc, terms found) in the order of texts.
+        Page texts are rarely repeated, so they are not kept in the Doc cache.
+        """
+        docs = self.nlp.pipe(texts, batch_size=self.batch_size, n_process=self.n_process)
+        return [(doc, self.terms_in(doc)) for doc in docs]
@@ -0,0 +1,227 @@
+"""Concurrent client for the Google Vision images:annotate endpoint"""
+import base64
+import http.client
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator
+from urllib.parse import urlsplit
+
+from anc_cli.cache import ResponseCache
+from anc_cli.profiling import stats
+
+VISION_ENDPOINT = 'https://vision.googleapis.com/v1/images:annotate'
+# responses worth retrying, anything else is raised straight away
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Vision accepts at most 16 images and 10MB of JSON per annotate request
+MAX_BATCH_SIZE = 16
+MAX_PAYLOAD_BYTES = 10 * 1024 * 1024
+
+class VisionError(Exception):
+    pass
+
+class RateLimiter:
+    """Spaces calls so that no more than `rate` start per second, shared by all threads"""
+
+    def __init__(self, rate:float=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class VisionClient:
+    """
+    Sends annotate requests from a bounded pool of worker threads.
+    Each thread keeps one persistent HTTP connection to the endpoint, the rate limit
+    is shared, and failed requests are retried with exponential backoff.
+    Up to batch_size images are packed into each request, as long as the request
+    stays under max_payload_bytes. With a ResponseCache, images seen before are
+    not sent again. `endpoint` can point to a local stand-in server for testing.
+    """
+
+    def __init__(self, api_key:str, endpoint:str=VISION_ENDPOINT, max_in_flight:int=8, rate_limit:float=None,
+                 retries:int=3, backoff:float=1.0, timeout:float=120, batch_size:int=4,
+                 max_payload_bytes:int=MAX_PAYLOAD_BYTES, cache:ResponseCache=None, force:bool=False):
+        self.api_key = api_key
+        self.cache = cache
+        # force: don't read from the cache, but still store the new responses
+        self.force = force
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_payload_bytes = max_payload_bytes
+        url = urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.path = f"{url.path}?key={api_key}"
+        self.max_in_flight = max_in_flight
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def _connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            if self.scheme == 'https':
+                connection = http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def _reset_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+        self.local.connection = None
+
+    def _post(self, payload:bytes):
+        self.rate_limiter.wait()
+        connection = self._connection()
+        try:
+            connection.request('POST', self.path, body=payload, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self._reset_connection()
+            raise
+
+    def annotate(self, body:dict) -> dict:
+        """POSTs one annotate request body and returns the decoded response"""
+        with stats.stage('ocr.request'):
+            return self._annotate(json.dumps(body).encode('utf-8'))
+
+    def _annotate(self, payload:bytes) -> dict:
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            stats.count('requests')
+            stats.count('bytes_uploaded', len(payload))
+            if attempt:
+                stats.count('retries')
+            try:
+                status, content = self._post(payload)
+            except (OSError, http.client.HTTPException) as e:
+                if last_attempt:
+                    raise VisionError(f"Request failed after {attempt + 1} attempts: {e}") from e
+            else:
+                if status == 200:
+                    return json.loads(content)
+                if status not in RETRY_STATUS or last_attempt:
+                    raise VisionError(f"Vision API returned {status}: {content[:500].decode('utf-8', 'replace')}")
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def batches(self, images:Iterable[bytes], language:str, feature:str) -> Iterator[list]:
+        """
+        Groups images into slots of (cache key, request entry, cached response) where
+        the entries still to be sent fit in one annotate call.
+        """
+        batch = []
+        n_entries = 0
+        size = 0
+        for image in images:
+            key = cached = None
+            if self.cache is not None:
+                key = self.cache.key(image, feature, language)
+                if not self.force:
+                    cached = self.cache.get(key)
+            if cached is not None:
+                stats.count('images_cached')
+                batch.append((key, None, cached))
+                continue
+            entry = image_entry(image, language, feature)
+            entry_size = len(entry['image']['content'])
+            if n_entries and (n_entries >= self.batch_size or size + entry_size > self.max_payload_bytes):
+                yield batch
+                batch = []
+                n_entries = 0
+                size = 0
+            batch.append((key, entry, None))
+            n_entries += 1
+            size += entry_size
+        if batch:
+            yield batch
+
+    def annotate_images(self, images:Iterable[bytes], language:str, feature:str='DOCUMENT_TEXT_DETECTION') -> Iterator[dict]:
+        """
+        OCRs encoded images concurrently and yields one {'responses': [response]} per image, in input order.
+        `images` is consumed lazily: at most max_in_flight requests (of batch_size images) are held at a time.
+        """
+        pending = deque()
+        for batch in self.batches(images, language, feature):
+            entries = [entry for key, entry, cached in batch if entry is not None]
+            future = self.executor.submit(self.annotate, {'requests': entries}) if entries else None
+            pending.append((future, batch))
+            if len(pending) >= self.max_in_flight:
+                yield from self.split_responses(*pending.popleft())
+        while pending:
+            yield from self.split_responses(*pending.popleft())
+
+    def split_responses(self, future, batch:list) -> list:
+        """Splits the response to a batched request into one response dict per image, caching new responses"""
+        responses = iter(future.result().get('responses', []) if future else [])
+        n_entries = sum(1 for key, entry, cached in batch if entry is not None)
+        output = []
+        for key, entry, cached in batch:
+            if entry is None:
+                output.append({'responses': [cached]})
+                continue
+            response = next(responses, None)
+            if response is None:
+                raise VisionError(f"Expected {n_entries} responses in batch")
+            # responses with an error are not cached, they will be retried next run
+            if self.cache is not None and 'error' not in response:
+                self.cache.put(key, response)
+            output.append({'responses': [response]})
+        return output
+
+    def close(self):
+        self.executor.shutdown()
+
+def response_cache(settings:dict=None) -> ResponseCache:
+    """ResponseCache configured from the `cache` section of settings.yml"""
+    cache = (settings or {}).get('cache') or {}
+    return ResponseCache(cache.get('dir', 'anc_cli/cache/responses'), cache.get('max_size_mb', 2048) * 1024 ** 2)
+
+def vision_client(api_key:str, settings:dict=None, force:bool=False) -> VisionClient:
+    """VisionClient configured from the `ocr` and `cache` sections of settings.yml"""
+    ocr = (settings or {}).get('ocr') or {}
+    return VisionClient(
+        api_key,
+        max_in_flight=ocr.get('max_in_flight', 8),
+        batch_size=ocr.get('batch_size', 4),
+        rate_limit=ocr.get('rate_limit'),
+        retries=ocr.get('retries', 3),
+        cache=response_cache(settings),
+        force=force,
+    )
+
+def annotate_files(client:VisionClient, paths:Iterable, language:str='es', feature:str='DOCUMENT_TEXT_DETECTION') -> Iterator[dict]:
+    """OCRs image files in batched, concurrent requests, yields one response per file in order. Files are read as they are sent."""
+    images = (Path(path).read_bytes() for path in paths)
+    return client.annotate_images(images, language, feature)
+
+def image_entry(image:bytes, language:str, feature:str='DOCUMENT_TEXT_DETECTION') -> dict:
+    """annotate request entry for one image"""
+    return {
+        'image': {
+            'content': base64.b64encode(image).decode('UTF-8')
+        },
+        'imageContext': {
+            'languageHints': [language]},
+            'features': [{
+                'type': feature
+            }]
+    }
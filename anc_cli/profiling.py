@@ -0,0 +1,122 @@
+"""Per-stage timers and counters for a run, written as a report by --profile"""
+import cProfile
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+class Stats:
+    """
+    Wall and CPU time of named stages, and counters, shared by all threads of a process.
+    Stage names are dotted, ex. ocr.request or matching.places. A stage can run inside
+    another (matching.places inside matching) and stages running in several threads at
+    once each add their own time, so stage times don't add up to the run time.
+    Nothing is recorded until enable() is called.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+        # stage name -> cProfile.Profile, see profile()
+        self.profilers = {}
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def profile(self, name:str):
+        """Captures a cProfile of the stage `name` too, in the threads that run it"""
+        self.profilers[name] = cProfile.Profile()
+
+    def stage(self, name:str):
+        """Context manager timing one run of a stage"""
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name:str):
+        profiler = self.profilers.get(name)
+        if profiler is not None:
+            profiler.enable()
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            cpu = time.thread_time() - cpu
+            wall = time.perf_counter() - wall
+            if profiler is not None:
+                profiler.disable()
+            with self.lock:
+                stage = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+                stage['calls'] += 1
+                stage['wall'] += wall
+                stage['cpu'] += cpu
+
+    def count(self, name:str, n:int=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        """Stages and counters recorded so far, and resets them, to be merged into the main process"""
+        with self.lock:
+            snapshot = dict(stages=self.stages, counters=self.counters)
+            self.stages = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot:dict):
+        with self.lock:
+            for name, other in snapshot['stages'].items():
+                stage = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+                for key in stage:
+                    stage[key] += other[key]
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        stages = []
+        for name, stage in sorted(self.stages.items()):
+            stages.append(dict(
+                stage=name,
+                calls=stage['calls'],
+                wall_s=round(stage['wall'], 4),
+                cpu_s=round(stage['cpu'], 4),
+                ms_per_call=round(1000 * stage['wall'] / stage['calls'], 3),
+            ))
+        throughput = {f'{name}_per_s': round(n / elapsed, 2) for name, n in self.counters.items() if elapsed}
+        return dict(elapsed_s=round(elapsed, 3), stages=stages, counters=dict(sorted(self.counters.items())), throughput=throughput)
+
+    def write(self, path:str) -> list:
+        """
+        Writes the report to <path>.json, the stages to <path>.csv and, for stages
+        passed to profile(), the cProfile stats to <path>-<stage>.prof. Returns the paths written.
+        """
+        report = self.report()
+        written = [Path(f'{path}.json'), Path(f'{path}.csv')]
+        written[0].write_text(json.dumps(report, indent=2))
+        with open(written[1], 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['stage', 'calls', 'wall_s', 'cpu_s', 'ms_per_call'])
+            writer.writeheader()
+            writer.writerows(report['stages'])
+            for name, n in report['counters'].items():
+                writer.writerow(dict(stage=f'count.{name}', calls=n))
+        for name, profiler in self.profilers.items():
+            prof_path = Path(f'{path}-{name}.prof')
+            profiler.dump_stats(str(prof_path))
+            written.append(prof_path)
+        return written
+
+# the stats of this process
+stats = Stats()
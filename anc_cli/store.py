@@ -0,0 +1,138 @@
+"""Compact on-disk format for saved Vision responses"""
+import gzip
+from pathlib import Path
+from typing import Iterable, Union
+import numpy as np
+import srsly
+
+from anc_cli.geometry import PageGeometry
+
+FORMAT_VERSION = 1
+# <name>.coords.npy: (n words, 8) x0 x1 x2 x3 y0 y1 y2 y3 of every word of every page, memory-mapped when read
+COORDS_SUFFIX = '.coords.npy'
+# <name>.meta.msgpack.gz: filename, page number, full text and word texts of each page, and where its rows start
+META_SUFFIX = '.meta.msgpack.gz'
+
+def is_compact(path:Path) -> bool:
+    return Path(path).name.endswith(META_SUFFIX)
+
+def response_stem(path:Path) -> str:
+    """Name of a saved response file without its suffixes, ex. acta_3 for acta_3.json and acta_3.meta.msgpack.gz"""
+    name = Path(path).name
+    if name.endswith(META_SUFFIX):
+        return name[:-len(META_SUFFIX)]
+    return Path(path).stem
+
+def saved_response_files(directory:Path) -> list:
+    """
+    Saved responses in directory and its subfolders, one file per name: the compact
+    file when there is one, as compact --keep-json leaves the JSON next to it.
+    """
+    directory = Path(directory)
+    files = {(path.parent, response_stem(path)): path for path in directory.rglob('*.json')}
+    files.update({(path.parent, response_stem(path)): path for path in directory.rglob(f'*{META_SUFFIX}')})
+    return sorted(files.values())
+
+def write_compact(path:Path, forms:Iterable[dict]) -> Path:
+    """
+    Saves the Vision responses of a file, as returned by pdf_to_data, in the compact format.
+    path is the name without suffixes, returns the path of the meta file.
+    Only what extraction reads is kept: the full text, and the text and box of each word.
+    """
+    path = Path(path)
+    pages = []
+    coords = []
+    n_rows = 0
+    for form in forms:
+        response = form['responses'][0]
+        annotations = response.get('textAnnotations', [])
+        page = dict(filename=form.get('filename'), page=form.get('page'), start=n_rows)
+        if annotations:
+            page['text'] = annotations[0].get('description', '')
+            page['locale'] = annotations[0].get('locale')
+            page['words'] = [word['description'] for word in annotations[1:]]
+            if len(annotations) > 1:
+                geometry = PageGeometry.from_words(form)
+                coords.append(np.hstack([geometry.x, geometry.y]))
+                n_rows += len(geometry)
+        if 'error' in response:
+            page['error'] = response['error']
+        page['end'] = n_rows
+        pages.append(page)
+    coords = np.vstack(coords) if coords else np.zeros((0, 8), dtype=np.int32)
+    # Vision coordinates are pixels, int16 is enough unless a page is over 32767 pixels
+    if not len(coords) or (coords.min() >= np.iinfo(np.int16).min and coords.max() <= np.iinfo(np.int16).max):
+        coords = coords.astype(np.int16)
+    np.save(path.with_name(path.name + COORDS_SUFFIX), coords)
+    meta_path = path.with_name(path.name + META_SUFFIX)
+    meta_path.write_bytes(gzip.compress(srsly.msgpack_dumps(dict(version=FORMAT_VERSION, pages=pages))))
+    return meta_path
+
+class CompactResponses:
+    """
+    Reads a file saved by write_compact. Pages are rebuilt on access as the dicts
+    get_data expects ({'responses': [{'textAnnotations': [...]}], 'page', 'filename'}),
+    the coordinates stay memory-mapped and are only read for the pages used.
+    """
+
+    def __init__(self, path:Path):
+        path = Path(path)
+        name = response_stem(path)
+        meta = srsly.msgpack_loads(gzip.decompress(path.with_name(name + META_SUFFIX).read_bytes()))
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {meta.get('version')}, expected {FORMAT_VERSION}")
+        self.pages = meta['pages']
+        self.coords = np.load(path.with_name(name + COORDS_SUFFIX), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i:int) -> dict:
+        page = self.pages[i]
+        response = {}
+        if 'text' in page:
+            full_text = {'description': page['text']}
+            if page.get('locale'):
+                full_text['locale'] = page['locale']
+            coords = np.asarray(self.coords[page['start']:page['end']]).tolist()
+            words = [
+                {'description': text, 'boundingPoly': {'vertices': [{'x': row[k], 'y': row[k + 4]} for k in range(4)]}}
+                for text, row in zip(page['words'], coords)
+            ]
+            response['textAnnotations'] = [full_text] + words
+        if 'error' in page:
+            response['error'] = page['error']
+        return {'responses': [response], 'page': page['page'], 'filename': page['filename']}
+
+    def text_page(self, i:int) -> dict:
+        """Page i with only its full text, the words are read with geometry(i)"""
+        page = self.pages[i]
+        response = {}
+        if 'text' in page:
+            response['textAnnotations'] = [{'description': page['text']}]
+        if 'error' in page:
+            response['error'] = page['error']
+        return {'responses': [response], 'page': page['page'], 'filename': page['filename']}
+
+    def geometry(self, i:int) -> PageGeometry:
+        """PageGeometry of the words of page i, straight from the arrays, without building dicts"""
+        page = self.pages[i]
+        coords = self.coords[page['start']:page['end']]
+        return PageGeometry(page.get('words', []), coords[:, :4], coords[:, 4:], ids=range(1, len(coords) + 1))
+
+def read_responses(path:Path) -> Union[list, CompactResponses]:
+    """The pages of a saved response file, JSON or compact"""
+    if is_compact(path):
+        return CompactResponses(path)
+    return srsly.read_json(path)
+
+def remove_responses(path:Path):
+    """Deletes a saved response file, with its coordinates if it is compact"""
+    path = Path(path)
+    if is_compact(path):
+        path.with_name(response_stem(path) + COORDS_SUFFIX).unlink(missing_ok=True)
+    path.unlink(missing_ok=True)
@@ -1,14 +1,17 @@
-import base64
 import io
 import os
+from queue import Full, Queue
+from threading import Event, Thread
 import typer
 from pathlib import Path
 import pandas as pd 
-from googleapiclient.discovery import build
-from pdf2image import convert_from_path
-from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image, ImageOps
 from fuzzysearch import find_near_matches
 from rich import print 
+from anc_cli.geometry import PageGeometry
+from anc_cli.ocr import VisionClient
+from anc_cli.profiling import stats
 
 type_ =  'DOCUMENT_TEXT_DETECTION'
 
@@ -33,7 +36,86 @@ def in_box(box_top_right, box_bottom_right, word_upper_left): #bl, tr, p):
   else :
     return False
 
-def get_data(form:dict, field:str, difference:int) -> list:
+class WordIndex:
+  """Index over the words of a single Vision response.
+
+  Word boxes are loaded once into a PageGeometry, so the "words to the right
+  of the label" query of `get_data` is a vectorized mask over the page
+  instead of a loop over the word dicts.
+  Build it once per page and pass it to `get_data` for every term.
+  geometry can be given when the words are already arrays, ex. store.CompactResponses.geometry,
+  then only the full text annotation of form is read.
+  """
+
+  def __init__(self, form:dict, geometry:PageGeometry=None):
+    annotations = form['responses'][0].get('textAnnotations') or [{}]
+    self.full_text = annotations[0].get('description', '')
+    self.page = form['page']
+    self.filename = form['filename']
+    self.geometry = geometry if geometry is not None else PageGeometry.from_words(form)
+    # lower cased token table: each distinct word is lower cased and matched once per page
+    self.tokens = {}
+    for i, text in enumerate(self.geometry.texts, start=1):
+      self.tokens.setdefault(text.lower(), []).append(i)
+
+  def right_of(self, min_x:int, min_y:int, max_y:int) -> list:
+    """Indexes of words with upper left x > min_x and min_y < y < max_y, in page order"""
+    return self.geometry.right_of(min_x, min_y, max_y)
+
+  def description(self, i:int) -> str:
+    """Text of word i, as a textAnnotations index: 0 is the full text"""
+    if i == 0:
+      return self.full_text
+    if 0 < i <= len(self.geometry):
+      return self.geometry.texts[i-1]
+    return ''
+
+def find_labels(index:WordIndex, fields:list, difference:int) -> dict:
+    """
+    Finds every configured field in one pass over the distinct words of a page.
+    A word shorter than len(field) - difference can not contain an approximate match,
+    so those are skipped before calling find_near_matches.
+    Returns {field: [(word index, number of matches)]} in page order.
+    """
+    hits = {field: [] for field in fields}
+    patterns = [(field, field.lower(), len(field) - difference) for field in fields]
+    for text, positions in index.tokens.items():
+      for field, pattern, min_length in patterns:
+        if len(text) < min_length:
+          continue
+        n = len(find_near_matches(pattern, text, max_l_dist=difference))
+        if n:
+          hits[field].extend((i, n) for i in positions)
+    for field in fields:
+      hits[field].sort()
+    return hits
+
+def get_data_for_terms(form:dict, fields:list, difference:int, index:WordIndex=None) -> dict:
+    """Runs `get_data` for all fields at once, returns {field: results}"""
+    if index is None:
+      index = WordIndex(form)
+    results = {}
+    for field, labels in find_labels(index, fields, difference).items():
+      results[field] = []
+      for i, n in labels:
+        key = index.description(i)
+        x, y = index.geometry.x[i-1], index.geometry.y[i-1]
+        # Search box: to the right of the label, from its top down to 75px below its bottom
+        # (see in_box, the vertices are upper left, upper right, lower right, lower left)
+        box_right = int(x[2])
+        box_top = int(y[1])
+        box_bottom = int(y[3])
+        values = index.right_of(box_right, box_top, box_bottom + 75) #TODO add slider to adjust this value
+        # one result per fuzzy match of the label, as before
+        for _ in range(n):
+          for j in values:
+            # textAnnotations[0] is the full text, kept as prior_word for the first word as before
+            prior_word = index.description(j-1)
+            next_word = index.description(j+1)
+            results[field].append(dict(value=index.description(j), key=key,page=index.page,filename=index.filename, next_word=next_word,prior_word=prior_word))
+    return results
+
+def get_data(form:dict, field:str, difference:int, index:WordIndex=None) -> list:
     '''
     Takes the json response from Google Vision for a single image.
     The image has one of the fields present in it.
@@ -46,58 +128,11 @@ def get_data(form:dict, field:str, difference:int) -> list:
                     form (dict): The result from Google Vision for an image
                     field
                     difference
+                    index (WordIndex): Optional prebuilt index for the page, shared across terms
             Returns:
                     field (str): A string of the field (departamento...)
     '''
-    results = []
-    page = form['page']
-    filename = form['filename']
-    for i, word in enumerate(form['responses'][0]['textAnnotations']):
-      if i != 0:
-        text = word['description']    
-        for match in find_near_matches(field.lower(), text.lower(), max_l_dist=difference):
-          verticies = word['boundingPoly']['vertices']
-          #upper left
-          ulX = verticies[0]['x']
-          ulY = verticies[0]['y']
-          #lower left
-          lolX = verticies[1]['x']
-          lolY = verticies[1]['y']
-          # lower right
-          lorX = verticies[2]['x']
-          lorY = verticies[2]['y']
-          # upper right
-          uprX = verticies[3]['x']
-          uprY = verticies[3]['y']
-          
-          #Search box 
-          x1 = uprX 
-          x2 = lorX 
-          y1 = uprY
-          y2 = lolY
-          box_bottom_left = (x2,y2)
-          box_top_right = (x1,y1)
-
-          # iterate over the words
-          for i, w in enumerate(form['responses'][0]['textAnnotations']):
-            if i != 0:
-              verts = w['boundingPoly']['vertices']
-                  
-              #upper left
-              word_upper_left = (verts[0]['x'],verts[0]['y'])
-              if in_box(box_bottom_left, box_top_right, word_upper_left):
-                  prior_word = ''
-                  try:
-                    prior_word = form['responses'][0]['textAnnotations'][i-1]['description']
-                  except:
-                    pass
-                  next_word = ''
-                  try:
-                    next_word = form['responses'][0]['textAnnotations'][i+1]['description']
-                  except:
-                    pass
-                  results.append(dict(value=w['description'], key=word['description'],page=page,filename=filename, next_word=next_word,prior_word=prior_word))
-    return results
+    return get_data_for_terms(form, [field], difference, index)[field]
 
 def image_to_byte_array(image: Image) -> bytes:
   imgByteArr = io.BytesIO()
@@ -105,6 +140,29 @@ def image_to_byte_array(image: Image) -> bytes:
   imgByteArr = imgByteArr.getvalue()
   return imgByteArr
 
+def encode_image(image: Image, format:str='JPEG', quality:int=85, grayscale:bool=False, binarize:bool=False, threshold:int=160, max_dimension:int=None) -> bytes:
+  """
+  Encodes a page image for upload. pdf2image returns uncompressed PPM images,
+  JPEG/WebP at a reasonable quality are a fraction of the size.
+  Settings come from the encoding section of settings.yml.
+  """
+  if max_dimension and max(image.size) > max_dimension:
+    image = ImageOps.contain(image, (max_dimension, max_dimension))
+  if grayscale or binarize:
+    image = image.convert('L')
+  if binarize:
+    image = image.point(lambda p: 255 if p > threshold else 0)
+    if format.upper() == 'PNG':
+      image = image.convert('1')
+  elif image.mode not in ('RGB', 'L'):
+    image = image.convert('RGB')
+  imgByteArr = io.BytesIO()
+  if format.upper() == 'PNG':
+    image.save(imgByteArr, format='PNG', optimize=True)
+  else:
+    image.save(imgByteArr, format=format, quality=quality)
+  return imgByteArr.getvalue()
+
 def has_terms(text:str):
   """A helper function to check if a text contains relevant terms"""
   match_terms = ['departamento', 'municipo','DEP.INT.COM.']
@@ -113,30 +171,81 @@ def has_terms(text:str):
       return True
   return False
 
-def pdf_to_data(path:str, language:str, APIKEY:str):
+def iter_pages(path:str, chunk_size:int=4, **kwargs):
+  """
+  Rasterizes a PDF lazily, chunk_size pages at a time, so that only one chunk of
+  decoded pages is in memory and OCR of earlier pages can start right away.
+  kwargs are passed to convert_from_path (dpi, grayscale...).
+  """
+  n_pages = pdfinfo_from_path(path)['Pages']
+  for first_page in range(1, n_pages + 1, chunk_size):
+    last_page = min(first_page + chunk_size - 1, n_pages)
+    with stats.stage('ocr.rasterize'):
+      images = convert_from_path(path, first_page=first_page, last_page=last_page, **kwargs)
+    stats.count('pages_rasterized', len(images))
+    for image in images:
+      yield image
+
+def prefetch(iterable, size:int):
+  """
+  Runs an iterator in a background thread, keeping at most `size` items ready.
+  Used to rasterize and encode the next pages while the current ones are being OCR'd.
+  When the consumer stops early, ex. on an OCR error, the thread stops too and the
+  items it had ready are released.
+  """
+  items = Queue(maxsize=size)
+  done = object()
+  stop = Event()
+  def put(item) -> bool:
+    # False once the consumer has stopped
+    while not stop.is_set():
+      try:
+        items.put(item, timeout=0.1)
+        return True
+      except Full:
+        pass
+    return False
+  def produce():
+    try:
+      for item in iterable:
+        if not put(item):
+          return
+    except Exception as e:
+      put(e)
+      return
+    put(done)
+  Thread(target=produce, name='prefetch', daemon=True).start()
+  try:
+    while True:
+      item = items.get()
+      if item is done:
+        return
+      if isinstance(item, Exception):
+        raise item
+      yield item
+  finally:
+    stop.set()
+
+def pdf_to_data(path:str, language:str, APIKEY:str, client:VisionClient=None, chunk_size:int=4, encoding:dict=None):
+    """
+    OCRs every page of a PDF, pages are sent concurrently through a VisionClient (one is created if not given).
+    Pages are rasterized as the client asks for them, see iter_pages, at encoding['dpi']
+    and encoded with the rest of the encoding settings, see encode_image.
+    """
     if APIKEY:
-        images = convert_from_path(path)
+        if client is None:
+            client = VisionClient(APIKEY)
+        encoding = dict(encoding or {})
+        dpi = encoding.pop('dpi', None) or 200
         data = []
-        for i, image in enumerate(images):
-            #Path(f'image{i}.jpg').write_bytes(image_to_byte_array(image))
-            image_content = base64.b64encode(image_to_byte_array(image))
-            vservice = build('vision', 'v1', developerKey=APIKEY)
-            request = vservice.images().annotate(body={
-                'requests': [{
-                    'image': {
-                        'content': image_content.decode('UTF-8')
-                    },
-                    'imageContext': {
-                        'languageHints': [language]},
-                        'features': [{
-                            'type': type_
-                        }]
-                }]
-            })
-            responses = request.execute(num_retries=3)
+        def encode(image):
+            with stats.stage('ocr.encode'):
+                return encode_image(image, **encoding)
+        contents = prefetch((encode(image) for image in iter_pages(path, chunk_size, dpi=dpi)), chunk_size)
+        for i, responses in enumerate(client.annotate_images(contents, language, type_)):
             responses['page'] = i
             responses['filename'] = str(path)
             data.append(responses)
         return data
     else:
-        print(f"[red] Please set the API key. [/red]")
\ No newline at end of file
+        print(f"[red] Please set the API key. [/red]")
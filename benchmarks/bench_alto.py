@@ -0,0 +1,93 @@
+"""Compares the streaming ALTO writer with the previous ElementTree vision_to_alto.
+
+    python benchmarks/bench_alto.py [n_pages] [words_per_page]
+
+previous builds a tree per image with one String per paragraph, as vision_to_alto did.
+tree volume builds one word level tree for all pages with ElementTree, and AltoWriter
+streams the same volume to the file. Reports pages/s and peak traced memory.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+from anc_cli.alto import AltoWriter
+from synthetic import make_full_text_page
+
+n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+n_words = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+
+# a few distinct pages, reused so that the responses themselves don't dominate memory
+pages = [make_full_text_page(n_words, seed) for seed in range(10)]
+
+def tree_alto(filename, response):
+    """vision_to_alto before the streaming writer, condensed"""
+    alto = Element("alto", {"xmlns": "http://www.loc.gov/standards/alto/ns-v4#"})
+    description = SubElement(alto, "Description")
+    SubElement(description, "MeasurementUnit").text = "pixel"
+    SubElement(SubElement(description, "sourceImageInformation"), "fileName").text = filename
+    layout = SubElement(alto, "Layout")
+    page = response["responses"][0]["fullTextAnnotation"]["pages"][0]
+    width, height = str(page["width"]), str(page["height"])
+    print_space = SubElement(SubElement(layout, "Page", {"WIDTH": width, "HEIGHT": height}), "PrintSpace")
+    for block in page["blocks"]:
+        for paragraph in block["paragraphs"]:
+            text = ""
+            for word in paragraph["words"]:
+                w = ""
+                for symbol in word["symbols"]:
+                    w += symbol["text"]
+                text += w + " "
+            v = paragraph["boundingBox"]["vertices"]
+            box = {"HPOS": str(v[0]["x"]), "VPOS": str(v[0]["y"]), "WIDTH": str(v[2]["x"] - v[0]["x"]), "HEIGHT": str(v[2]["y"] - v[0]["y"])}
+            text_block = SubElement(print_space, "TextBlock", dict(box, ID="text_block_1"))
+            text_line = SubElement(text_block, "TextLine", dict(box, ID=f"line_{box['HPOS']}_{box['VPOS']}"))
+            SubElement(text_line, "String", dict(box, CONTENT=text))
+    return tostring(alto, encoding="unicode")
+
+def previous(directory):
+    for i in range(n_pages):
+        with open(os.path.join(directory, f"{i}.xml"), "w", encoding="utf-8") as f:
+            f.write(tree_alto(f"{i}.jpg", pages[i % len(pages)]))
+
+def tree_volume(directory):
+    """A multi-page, word level ALTO with ElementTree: the whole volume is one tree"""
+    alto = Element("alto", {"xmlns": "http://www.loc.gov/standards/alto/ns-v4#"})
+    layout = SubElement(alto, "Layout")
+    for i in range(n_pages):
+        page = pages[i % len(pages)]["responses"][0]["fullTextAnnotation"]["pages"][0]
+        print_space = SubElement(SubElement(layout, "Page", {"ID": f"p{i + 1}"}), "PrintSpace")
+        for b, block in enumerate(page["blocks"]):
+            text_block = SubElement(print_space, "TextBlock", {"ID": f"p{i + 1}_b{b + 1}"})
+            for l, paragraph in enumerate(block["paragraphs"]):
+                text_line = SubElement(text_block, "TextLine", {"ID": f"p{i + 1}_b{b + 1}_l{l + 1}"})
+                for w, word in enumerate(paragraph["words"]):
+                    v = word["boundingBox"]["vertices"]
+                    content = "".join(symbol["text"] for symbol in word["symbols"])
+                    SubElement(text_line, "String", {
+                        "ID": f"p{i + 1}_b{b + 1}_l{l + 1}_w{w + 1}", "CONTENT": content,
+                        "HPOS": str(v[0]["x"]), "VPOS": str(v[0]["y"]), "WIDTH": str(v[2]["x"] - v[0]["x"]), "HEIGHT": str(v[2]["y"] - v[0]["y"]),
+                    })
+    with open(os.path.join(directory, "volume.xml"), "w", encoding="utf-8") as f:
+        f.write(tostring(alto, encoding="unicode"))
+
+def streaming(directory):
+    with open(os.path.join(directory, "volume.xml"), "w", encoding="utf-8") as f, AltoWriter(f, "volume.pdf") as alto:
+        for i in range(n_pages):
+            alto.add_page(pages[i % len(pages)])
+
+for name, run in (("previous", previous), ("tree volume", tree_volume), ("AltoWriter", streaming)):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        run(directory)
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+    # traced separately, tracemalloc slows everything down
+    with tempfile.TemporaryDirectory() as directory:
+        tracemalloc.start()
+        run(directory)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    print(f"{name:12} {n_pages / elapsed:8.1f} pages/s  peak {peak / 1024 ** 2:6.1f} MB  output {size / 1024 ** 2:6.1f} MB")
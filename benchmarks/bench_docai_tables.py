@@ -0,0 +1,68 @@
+"""Compares process_data with the previous cell-by-cell matching over flattened tables.
+
+    python benchmarks/bench_docai_tables.py [n_documents] [tables_per_document]
+
+Documents are synthetic Document AI tables of label/value rows mixed with filler.
+"""
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from anc_cli import doc_ai
+from anc_cli.matchers import MatcherRegistry
+from synthetic import FILLER, LABELS, noisy, place_names
+
+n_documents = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+n_tables = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+rng = random.Random(0)
+places = place_names()
+
+def make_table() -> list:
+    rows = []
+    for _ in range(rng.randint(3, 12)):
+        if rng.random() < 0.3:
+            rows.append([rng.choice(LABELS).upper(), noisy(rng.choice(places).title(), rng, 0.05), rng.choice(FILLER)])
+        else:
+            rows.append([rng.choice(FILLER) for _ in range(3)])
+    return rows
+
+data = [{'file': f'doc_{i}.pdf', 'items': [make_table() for _ in range(n_tables)]} for i in range(n_documents)]
+
+def flatten(lst):
+    """Flattens nested lists, as process_data did before tables kept their structure"""
+    flattened = []
+    stack = [iter(lst)]
+    while stack:
+        for i in stack[-1]:
+            if isinstance(i, list):
+                stack.append(iter(i))
+                break
+            flattened.append(i)
+        else:
+            stack.pop()
+    return flattened
+
+def previous(data, registry):
+    """process_data before tables kept their structure"""
+    for page in data:
+        items = flatten(page['items'])
+        docs = registry.docs(items)
+        for ix, item in enumerate(items):
+            term_match = registry.terms_in(docs[item])
+            try:
+                place_match = [match_id for match_id, start, end, ratio in registry.places_in(docs[items[ix + 1]])]
+                term_match[0], place_match[0]
+            except IndexError:
+                pass
+
+doc_ai.save_dir = lambda: Path(tempfile.mkdtemp())
+for name, run in (('cell by cell', previous), ('process_data', doc_ai.process_data)):
+    registry = MatcherRegistry('es', [label for label in LABELS], 85)
+    registry.resolver
+    start = time.perf_counter()
+    run(data, registry)
+    elapsed = time.perf_counter() - start
+    print(f"{name:14} {n_documents / elapsed:8.1f} documents/s")
@@ -0,0 +1,50 @@
+"""Payload size and latency of the page encoding settings.
+
+    python benchmarks/bench_encoding.py scan.pdf [n_pages]
+
+Reports the base64 payload per page and the encoding time for each setting.
+If APIKEY is set in the environment the pages are also sent to Vision and the
+end-to-end latency and number of words found are reported.
+"""
+import base64
+import os
+import sys
+import time
+
+from anc_cli.ocr import VisionClient
+from anc_cli.utils import encode_image, iter_pages
+
+SETTINGS = [
+    dict(dpi=200, format='PNG'),
+    dict(dpi=200, format='JPEG', quality=95),
+    dict(dpi=200, format='JPEG', quality=85),
+    dict(dpi=200, format='JPEG', quality=70),
+    dict(dpi=200, format='JPEG', quality=85, grayscale=True),
+    dict(dpi=200, format='PNG', binarize=True),
+    dict(dpi=200, format='WEBP', quality=80),
+    dict(dpi=150, format='JPEG', quality=85),
+    dict(dpi=300, format='JPEG', quality=85, max_dimension=2400),
+]
+
+pdf = sys.argv[1]
+n_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+api_key = os.environ.get('APIKEY')
+client = VisionClient(api_key) if api_key else None
+
+print(f"{'setting':60} {'KB/page':>8} {'encode ms':>10} {'OCR s/page':>10} {'words':>6}")
+for setting in SETTINGS:
+    setting = dict(setting)
+    dpi = setting.pop('dpi')
+    images = [image for image, _ in zip(iter_pages(pdf, dpi=dpi), range(n_pages))]
+    start = time.perf_counter()
+    encoded = [encode_image(image, **setting) for image in images]
+    encode_time = (time.perf_counter() - start) / len(images)
+    size = sum(len(base64.b64encode(e)) for e in encoded) / len(encoded)
+    ocr_time, words = '', ''
+    if client:
+        start = time.perf_counter()
+        responses = list(client.annotate_images(encoded, 'es'))
+        ocr_time = f"{(time.perf_counter() - start) / len(encoded):.2f}"
+        words = sum(len(r['responses'][0].get('textAnnotations', [])) for r in responses)
+    name = f"dpi={dpi} " + ' '.join(f"{k}={v}" for k, v in setting.items())
+    print(f"{name:60} {size / 1024:8.0f} {encode_time * 1000:10.1f} {ocr_time:>10} {words:>6}")
@@ -0,0 +1,43 @@
+"""Compares the label/value lookup of get_data with a naive per-term scan.
+
+    python benchmarks/bench_get_data.py 3000
+"""
+import sys
+import timeit
+
+from fuzzysearch import find_near_matches
+from anc_cli.utils import WordIndex, get_data_for_terms, in_box
+from synthetic import LABELS, make_page
+
+n_words = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+page = make_page(n_words)
+
+
+def naive_get_data(form:dict, field:str, difference:int) -> list:
+    """The lookup as it was before the word index: every word, for every label match"""
+    results = []
+    annotations = form['responses'][0]['textAnnotations']
+    for i, word in enumerate(annotations):
+        if i == 0:
+            continue
+        for match in find_near_matches(field.lower(), word['description'].lower(), max_l_dist=difference):
+            vertices = word['boundingPoly']['vertices']
+            for j, w in enumerate(annotations):
+                if j != 0 and in_box((vertices[2]['x'], vertices[1]['y']), (vertices[3]['x'], vertices[3]['y']), (w['boundingPoly']['vertices'][0]['x'], w['boundingPoly']['vertices'][0]['y'])):
+                    next_word = annotations[j + 1]['description'] if j + 1 < len(annotations) else ''
+                    results.append(dict(value=w['description'], key=word['description'], page=form['page'], filename=form['filename'], next_word=next_word, prior_word=annotations[j - 1]['description']))
+    return results
+
+
+def per_term():
+    return {term: naive_get_data(page, term, 2) for term in LABELS}
+
+
+def single_pass():
+    return get_data_for_terms(page, LABELS, 2, WordIndex(page))
+
+
+assert per_term() == single_pass()
+for fn in (per_term, single_pass):
+    t = min(timeit.repeat(fn, number=3, repeat=3)) / 3
+    print(f"{fn.__name__:12} {n_words} words: {t * 1000:.1f} ms/page")
@@ -0,0 +1,32 @@
+"""Lookups per second of the tiered PlaceResolver against spaczz's place_matcher.
+
+    python benchmarks/bench_places.py [n_samples] [noise_level]
+
+Samples are place names with OCR-like noise. Also reports how often the two
+give the same matches, which should be always.
+"""
+import random
+import sys
+import time
+
+from anc_cli.matchers import MatcherRegistry
+from synthetic import noisy, place_names
+
+n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+level = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+
+rng = random.Random(0)
+samples = [noisy(rng.choice(place_names()), rng, level) for _ in range(n_samples)]
+fuzzy = MatcherRegistry('es', ['departamento', 'municipio'], 85, place_lookup='fuzzy')
+tiered = MatcherRegistry('es', ['departamento', 'municipio'], 85, place_lookup='tiered')
+docs = fuzzy.docs(samples)
+tiered.resolver
+
+matches = {}
+for name, registry in (('place_matcher', fuzzy), ('tiered', tiered)):
+    start = time.perf_counter()
+    matches[name] = [registry.find_places(docs[s]) for s in samples]
+    elapsed = time.perf_counter() - start
+    print(f"{name:14} {n_samples / elapsed:10.0f} lookups/s")
+agree = sum(a == b for a, b in zip(matches['place_matcher'], matches['tiered']))
+print(f"same matches for {agree} of {n_samples} samples")
@@ -0,0 +1,228 @@
+"""Benchmark suite over synthetic Vision responses, with results saved per commit.
+
+    PYTHONPATH=. python benchmarks/suite.py [--quick] [--filter extract] [--compare 125794b]
+
+Each case runs at every combination of its parameters (word count, OCR noise...) on
+pages generated from fixed seeds, so two runs on the same machine measure the same
+work. Results go to benchmarks/results/<commit>.json; --compare prints the change in
+median time against an earlier result file, or the result of a commit, and
+--max-slowdown makes the run fail when a case got slower than that.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from io import StringIO
+from pathlib import Path
+
+from synthetic import LABELS, make_document, make_full_text_page, noisy, place_names
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+TERMS = ['departamento', 'municipio']
+MATCH_RATIO = 85
+
+# name -> (setup, parameter grid), see case
+CASES = {}
+
+
+def case(name:str, **grid):
+    """
+    Registers a benchmark. setup(**params) prepares its data, untimed, and returns
+    (run, n_items, unit, reset): run() is timed, reset() is called untimed before each run.
+    """
+    def register(setup):
+        CASES[name] = (setup, grid)
+        return setup
+    return register
+
+
+_registries = {}
+
+
+def registry(place_lookup:str='tiered'):
+    """One loaded MatcherRegistry per place_lookup, shared by the cases"""
+    if place_lookup not in _registries:
+        from anc_cli.matchers import MatcherRegistry
+        r = MatcherRegistry('es', TERMS, MATCH_RATIO, place_lookup=place_lookup)
+        r.nlp
+        if place_lookup == 'tiered':
+            r.resolver
+        _registries[place_lookup] = r
+    return _registries[place_lookup]
+
+
+def clear_docs(r):
+    # tokenized values are cached for the run, every repeat starts without them
+    return lambda: r._docs.clear()
+
+
+@case('classify', words=[300, 1000], noise=[0.0, 0.1])
+def classify(words, noise):
+    from anc_cli.extract import page_text
+    r = registry()
+    texts = [page_text(page) for page in make_document(16, words, noise=noise, label_rate=0.05)]
+    return (lambda: r.classify(texts)), len(texts), 'pages', None
+
+
+@case('get_data', words=[500, 2000, 5000])
+def get_data(words):
+    from anc_cli.utils import WordIndex, get_data_for_terms
+    pages = make_document(8, words, label_rate=0.05)
+    def run():
+        for page in pages:
+            get_data_for_terms(page, LABELS, 2, WordIndex(page))
+    return run, len(pages), 'pages', None
+
+
+@case('extract_pages', words=[300, 1000], noise=[0.0, 0.1, 0.2])
+def extract_pages(words, noise):
+    from anc_cli.extract import extract_pages
+    r = registry()
+    pages = make_document(32, words, noise=noise, label_rate=0.05)
+    return (lambda: extract_pages(pages, r)), len(pages), 'pages', clear_docs(r)
+
+
+@case('places', lookup=['tiered', 'fuzzy'], noise=[0.0, 0.1, 0.2])
+def places(lookup, noise):
+    r = registry(lookup)
+    rng = random.Random(0)
+    samples = [noisy(rng.choice(place_names()), rng, noise) for _ in range(300)]
+    docs = r.docs(samples)
+    docs = [docs[sample] for sample in samples]
+    def run():
+        for doc in docs:
+            r.find_places(doc)
+    return run, len(docs), 'lookups', None
+
+
+@case('alto', words=[400, 1500])
+def alto(words):
+    from anc_cli.alto import write_alto
+    pages = [make_full_text_page(words, seed) for seed in range(8)]
+    return (lambda: write_alto(StringIO(), 'synthetic.pdf', pages)), len(pages), 'pages', None
+
+
+@case('layout', words=[400, 1500])
+def layout(words):
+    from anc_cli.layout import PageLayout
+    pages = [make_full_text_page(words, seed) for seed in range(8)]
+    labels = [label.upper() for label in LABELS]
+    def run():
+        for page in pages:
+            PageLayout(page).next_fields(labels)
+    return run, len(pages), 'pages', None
+
+
+def measure(setup, params:dict, repeat:int) -> dict:
+    run, n_items, unit, reset = setup(**params)
+    # warm up caches and lazy loading, not recorded
+    if reset:
+        reset()
+    run()
+    times = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return dict(
+        params=params, repeat=repeat, n_items=n_items, unit=unit,
+        min_s=min(times), median_s=median, items_per_s=n_items / median,
+    )
+
+
+def case_id(name:str, params:dict) -> str:
+    #ex. extract_pages[words=300,noise=0.1]
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+def commit() -> str:
+    def git(*args):
+        return subprocess.run(['git', *args], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    sha = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    # uncommitted changes to the package make the result not that of the commit
+    return sha + '-dirty' if git('status', '--porcelain', '--untracked-files=no', '--', 'anc_cli') else sha
+
+
+def environment() -> dict:
+    versions = {}
+    for module in ['numpy', 'spacy', 'spaczz', 'rapidfuzz']:
+        try:
+            versions[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            versions[module] = None
+    return dict(python=platform.python_version(), platform=platform.platform(), machine=platform.machine(),
+                cpus=os.cpu_count(), **versions)
+
+
+def run_suite(names:list, quick:bool, repeat:int) -> dict:
+    results = {}
+    for name in names:
+        setup, grid = CASES[name]
+        values = [v[:1] for v in grid.values()] if quick else list(grid.values())
+        for combination in itertools.product(*values):
+            params = dict(zip(grid, combination))
+            result = measure(setup, params, repeat)
+            results[case_id(name, params)] = result
+            print(f"{case_id(name, params):45} {1000 * result['median_s']:10.2f} ms {result['items_per_s']:10.1f} {result['unit']}/s", flush=True)
+    return results
+
+
+def load_results(reference:str) -> dict:
+    """A result file, or the result saved for a commit"""
+    path = Path(reference)
+    if not path.exists():
+        path = RESULTS_DIR / f"{reference}.json"
+    return json.loads(path.read_text())
+
+
+def compare(results:dict, reference:dict) -> float:
+    """Prints median time against the reference for the cases run in both, returns the largest slowdown"""
+    print(f"\ncompared with {reference['commit']}")
+    worst = 0.0
+    for id, result in results.items():
+        before = reference['results'].get(id)
+        if before is None:
+            continue
+        change = result['median_s'] / before['median_s'] - 1
+        worst = max(worst, change)
+        print(f"{id:45} {1000 * before['median_s']:10.2f} ms -> {1000 * result['median_s']:10.2f} ms {100 * change:+7.1f}%")
+    if reference.get('environment') != environment():
+        print("note: the reference was run in a different environment")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filter', default='', help='only cases whose name contains this')
+    parser.add_argument('--quick', action='store_true', help='first parameter values only, 3 repeats')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--output', help=f'result file, default {RESULTS_DIR.name}/<commit>.json')
+    parser.add_argument('--compare', help='result file or commit to compare with')
+    parser.add_argument('--max-slowdown', type=float, help='exit with 1 if a case is slower than the reference by more than this, ex. 0.2')
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.filter in name]
+    sha = commit()
+    results = run_suite(names, args.quick, 3 if args.quick else args.repeat)
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{sha}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(dict(commit=sha, date=time.strftime('%Y-%m-%dT%H:%M:%S'), environment=environment(), results=results), indent=2))
+    print(f"results written to {output}")
+    if args.compare:
+        worst = compare(results, load_results(args.compare))
+        if args.max_slowdown is not None and worst > args.max_slowdown:
+            print(f"slower than the reference by {100 * worst:.1f}%")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Synthetic Google Vision responses for benchmarks"""
+import random
+import unicodedata
+from functools import lru_cache
+import srsly
+
+LABELS = ['departamento', 'municipio', 'dep.int.com', 'proponente']
+FILLER = ['fecha', 'nombre', 'de', 'la', 'el', 'no', 'valor', 'total', 'firma', 'cedula', 'dirección', 'teléfono']
+
+
+# common OCR confusions
+CONFUSIONS = {'o': '0', 'l': '1', 'i': 'l', 'e': 'c', 'a': 'o', 's': '5', 'b': 'h', 'n': 'h', 'rn': 'm', 'm': 'rn'}
+
+
+def strip_accents(text:str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def noisy(text:str, rng:random.Random, level:float=0.1) -> str:
+    """OCR-like noise: dropped accents, case changes and, with probability level per character, a confusion"""
+    if rng.random() < 0.5:
+        text = strip_accents(text)
+    text = rng.choice([text, text.upper(), text.title()])
+    output = []
+    i = 0
+    while i < len(text):
+        pair = text[i:i + 2].lower()
+        if pair in CONFUSIONS and rng.random() < level:
+            output.append(CONFUSIONS[pair])
+            i += 2
+        elif text[i].lower() in CONFUSIONS and rng.random() < level:
+            output.append(CONFUSIONS[text[i].lower()])
+            i += 1
+        else:
+            output.append(text[i])
+            i += 1
+    return ''.join(output)
+
+
+@lru_cache()
+def place_names() -> list:
+    return srsly.read_json('anc_cli/data/municipios.json') + srsly.read_json('anc_cli/data/departamentos.json')
+
+
+def make_word(text:str, x:int, y:int, width:int, height:int) -> dict:
+    vertices = [
+        {'x': x, 'y': y},
+        {'x': x + width, 'y': y},
+        {'x': x + width, 'y': y + height},
+        {'x': x, 'y': y + height},
+    ]
+    return {'description': text, 'boundingPoly': {'vertices': vertices}}
+
+
+def make_page(n_words:int, seed:int=0, page:int=0, filename:str='synthetic.pdf', noise:float=0.0, label_rate:float=0.02) -> dict:
+    """
+    A page of n_words words laid out in lines, with form labels followed by place names.
+    A share label_rate of the lines of words are a label and its place, with noise > 0 both
+    get OCR-like noise at that level, see noisy.
+    """
+    rng = random.Random(seed)
+    places = place_names()
+    words = []
+    x, y = 50, 50
+    while len(words) < n_words:
+        if rng.random() < label_rate:
+            label, place = rng.choice(LABELS).upper(), rng.choice(places).title()
+            if noise:
+                label, place = noisy(label, rng, noise), noisy(place, rng, noise)
+            texts = [label] + place.split()
+        else:
+            texts = [rng.choice(FILLER)]
+        for text in texts:
+            width = 14 * len(text) + 10
+            words.append(make_word(text, x, y, width, 30))
+            x += width + 15
+            if x > 2400:
+                x, y = 50, y + 45
+    words = words[:n_words]
+    full_text = ' '.join(w['description'] for w in words)
+    return {
+        'responses': [{'textAnnotations': [{'description': full_text}] + words}],
+        'page': page,
+        'filename': filename,
+    }
+
+
+def make_document(n_pages:int, n_words:int, seed:int=0, filename:str='synthetic.pdf', **kwargs) -> list:
+    """The pages of a PDF as saved by process, page i generated with seed + i, kwargs are passed to make_page"""
+    return [make_page(n_words, seed + i, page=i, filename=filename, **kwargs) for i in range(n_pages)]
+
+
+def make_symbols(text:str, x:int, y:int, char_width:int, height:int, detected_break:str=None) -> list:
+    symbols = []
+    for i, char in enumerate(text):
+        symbol = {'text': char, 'boundingBox': {'vertices': [
+            {'x': x + i * char_width, 'y': y},
+            {'x': x + (i + 1) * char_width, 'y': y},
+            {'x': x + (i + 1) * char_width, 'y': y + height},
+            {'x': x + i * char_width, 'y': y + height},
+        ]}}
+        symbols.append(symbol)
+    if detected_break and symbols:
+        symbols[-1]['property'] = {'detectedBreak': {'type': detected_break}}
+    return symbols
+
+
+def make_full_text_page(n_words:int, seed:int=0, words_per_line:int=12, lines_per_paragraph:int=4, paragraphs_per_block:int=3,
+                        noise:float=0.0) -> dict:
+    """
+    A Vision response with a fullTextAnnotation of n_words words, grouped in lines,
+    paragraphs and blocks, with detectedBreak on the last symbol of each word.
+    With noise > 0 labels and place names get OCR-like noise at that level.
+    """
+    rng = random.Random(seed)
+    places = place_names()
+    blocks = []
+    block = paragraph = None
+    x, y = 50, 50
+    n_lines = 0
+    for n in range(n_words):
+        if n % words_per_line == 0:
+            if n_lines % lines_per_paragraph == 0:
+                if n_lines % (lines_per_paragraph * paragraphs_per_block) == 0:
+                    block = {'paragraphs': []}
+                    blocks.append(block)
+                paragraph = {'words': []}
+                block['paragraphs'].append(paragraph)
+            n_lines += 1
+            x, y = 50, y + 45
+        if rng.random() < 0.05:
+            text = rng.choice(LABELS).upper()
+            text = noisy(text, rng, noise) if noise else text
+        elif rng.random() < 0.05:
+            text = rng.choice(places).title().split()[0]
+            text = noisy(text, rng, noise) if noise else text
+        else:
+            text = rng.choice(FILLER)
+        end_of_line = (n + 1) % words_per_line == 0 or n + 1 == n_words
+        symbols = make_symbols(text, x, y, 14, 30, 'EOL_SURE_SPACE' if end_of_line else 'SPACE')
+        word = make_word(text, x, y, 14 * len(text), 30)
+        paragraph['words'].append({'boundingBox': word['boundingPoly'], 'symbols': symbols, 'confidence': round(rng.uniform(0.6, 1.0), 2)})
+        x += 14 * len(text) + 15
+    for block in blocks:
+        for paragraph in block['paragraphs']:
+            boxes = [w['boundingBox']['vertices'] for w in paragraph['words']]
+            paragraph['boundingBox'] = bounding_box(boxes)
+        block['boundingBox'] = bounding_box([p['boundingBox']['vertices'] for p in block['paragraphs']])
+    return {'responses': [{'fullTextAnnotation': {'pages': [{'width': 2500, 'height': y + 100, 'blocks': blocks}]}}]}
+
+
+def bounding_box(vertex_lists:list) -> dict:
+    xs = [v['x'] for vertices in vertex_lists for v in vertices]
+    ys = [v['y'] for vertices in vertex_lists for v in vertices]
+    return {'vertices': [
+        {'x': min(xs), 'y': min(ys)},
+        {'x': max(xs), 'y': min(ys)},
+        {'x': max(xs), 'y': max(ys)},
+        {'x': min(xs), 'y': max(ys)},
+    ]}
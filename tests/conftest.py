@@ -0,0 +1,19 @@
+"""Parts of Vision responses shared by the tests"""
+
+
+def box(x, y, w=100, h=20):
+    # Vision leaves out coordinates that are 0
+    vertices = [{"x": x, "y": y}, {"x": x + w, "y": y}, {"x": x + w, "y": y + h}, {"x": x, "y": y + h}]
+    return {"vertices": [{k: v for k, v in vertex.items() if v} for vertex in vertices]}
+
+
+def word(text, x, y, w=100, h=20):
+    """A word of textAnnotations"""
+    return {"description": text, "boundingPoly": box(x, y, w, h)}
+
+
+def symbols_word(text, x, y, detected_break="SPACE"):
+    """A word of fullTextAnnotation, 10 pixels wide per character"""
+    symbols = [{"text": c} for c in text]
+    symbols[-1]["property"] = {"detectedBreak": {"type": detected_break}}
+    return {"boundingBox": box(x, y, 10 * len(text)), "symbols": symbols}
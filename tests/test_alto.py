@@ -0,0 +1,46 @@
+import io
+from xml.etree import ElementTree
+
+import pytest
+
+from anc_cli import alto
+
+from .conftest import box, symbols_word
+
+NS = {"alto": "http://www.loc.gov/standards/alto/ns-v4#"}
+
+
+def word(text, x, y, detected_break="SPACE"):
+    return dict(symbols_word(text, x, y, detected_break), confidence=0.9)
+
+
+def response():
+    paragraph = {
+        "boundingBox": box(10, 10, 290, 50),
+        "words": [word("DEPARTAMENTO", 10, 10), word("Valle", 140, 10, "EOL_SURE_SPACE"), word("del", 10, 40), word("Cau", 50, 40, "HYPHEN"), word("<ca>", 10, 70)],
+    }
+    block = {"boundingBox": paragraph["boundingBox"], "paragraphs": [paragraph]}
+    return {"responses": [{"fullTextAnnotation": {"pages": [{"width": 400, "height": 500, "blocks": [block, block]}]}}]}
+
+
+def test_word_level_strings_with_unique_ids():
+    xml = alto.vision_to_alto("a.jpg", response())
+    root = ElementTree.fromstring(xml)
+    lines = root.findall(".//alto:TextLine", NS)
+    assert len(lines) == 6
+    assert [s.get("CONTENT") for s in lines[0].findall("alto:String", NS)] == ["DEPARTAMENTO", "Valle"]
+    assert lines[0].get("HPOS") == "10" and lines[0].get("WIDTH") == "180"
+    assert lines[1].find("alto:HYP", NS) is not None
+    assert lines[2].find("alto:String", NS).get("CONTENT") == "<ca>"
+    ids = [e.get("ID") for e in root.iter() if e.get("ID")]
+    assert len(ids) == len(set(ids))
+    assert "p1_b2_l3_w1" in ids
+
+
+def test_multi_page_volume_is_streamed():
+    output = io.StringIO()
+    assert alto.write_alto(output, "volume.pdf", (response() for _ in range(3))) == 3
+    root = ElementTree.fromstring(output.getvalue())
+    pages = root.findall(".//alto:Page", NS)
+    assert [p.get("ID") for p in pages] == ["p1", "p2", "p3"]
+    assert root.find(".//alto:fileName", NS).text == "volume.pdf"
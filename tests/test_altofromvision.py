@@ -0,0 +1,54 @@
+import json
+import os
+import time
+
+import pytest
+
+pytest.importorskip("dotenv")
+import altofromvision as alto
+
+
+def test_pending_images_skips_up_to_date_alto(tmp_path):
+    outpath = tmp_path / "alto"
+    outpath.mkdir()
+    images = []
+    for name in ["a", "b", "c"]:
+        image = tmp_path / f"{name}.jpg"
+        image.write_bytes(name.encode())
+        images.append(image)
+    (outpath / "a.xml").write_text("<alto/>")
+    # b.xml is older than its image
+    (outpath / "b.xml").write_text("<alto/>")
+    past = time.time() - 60
+    os.utime(outpath / "b.xml", (past, past))
+
+    assert [image.name for image, xml_path, digest in alto.pending_images(images, outpath, "mtime", {})] == ["b.jpg", "c.jpg"]
+    assert len(alto.pending_images(images, outpath, "none", {})) == 3
+
+    manifest = {"a.xml": alto.file_hash(images[0]), "b.xml": alto.file_hash(images[0])}
+    pending = alto.pending_images(images, outpath, "hash", manifest)
+    assert [(image.name, xml_path.name) for image, xml_path, digest in pending] == [("b.jpg", "b.xml"), ("c.jpg", "c.xml")]
+    assert pending[0][2] == alto.file_hash(images[1])
+
+
+def test_failed_ocr_writes_no_alto(tmp_path, monkeypatch):
+    for name in ["a", "b"]:
+        (tmp_path / f"{name}.jpg").write_bytes(name.encode())
+    page = {"fullTextAnnotation": {"pages": [{"width": 100, "height": 100, "blocks": []}]}}
+    failed = {"error": {"code": 3, "message": "Bad image data."}}
+    monkeypatch.setattr(alto, "response_cache", lambda: None)
+    monkeypatch.setattr(alto, "annotate_files", lambda client, images: iter([{"responses": [page]}, {"responses": [failed]}]))
+    alto.main(tmp_path, workers=1, skip="hash")
+    assert sorted(path.name for path in (tmp_path / "alto").iterdir()) == ["a.xml", "manifest.json"]
+    assert list(json.loads((tmp_path / "alto" / "manifest.json").read_text())) == ["a.xml"]
+    # b.jpg is not up to date, it is OCR'd again next run
+    pending = alto.pending_images(sorted(tmp_path.glob("*.jpg")), tmp_path / "alto", "hash", {"a.xml": alto.file_hash(tmp_path / "a.jpg")})
+    assert [image.name for image, xml_path, digest in pending] == ["b.jpg"]
+
+
+def test_convert_leaves_no_partial_alto_when_a_page_failed(tmp_path):
+    page = {"responses": [{"fullTextAnnotation": {"pages": [{"width": 100, "height": 100, "blocks": []}]}}]}
+    failed = {"responses": [{"error": {"code": 13, "message": "Internal error."}}]}
+    with pytest.raises(alto.OCRError, match="page 2: Internal error."):
+        alto.convert("a.pdf", [page, failed], tmp_path / "a.xml")
+    assert list(tmp_path.iterdir()) == []
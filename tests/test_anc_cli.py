@@ -1,5 +1,51 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
 from anc_cli import __version__
 
+from .conftest import word
+
 
 def test_version():
     assert __version__ == '0.1.0'
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    pytest.importorskip("spaczz")
+    # main reads its settings relative to the working directory when imported
+    package = Path(__file__).parent.parent / "anc_cli"
+    (tmp_path / "anc_cli").mkdir()
+    (tmp_path / "anc_cli" / "settings.yml").write_text((package / "settings.yml").read_text())
+    (tmp_path / "anc_cli" / "apikey.yml").write_text("APIKEY: test\n")
+    (tmp_path / "anc_cli" / "data").symlink_to(package / "data")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delitem(sys.modules, "anc_cli.main", raising=False)
+    from anc_cli import main
+    return main
+
+
+def test_extract_reruns_matching_on_saved_responses(main, tmp_path):
+    testing = pytest.importorskip("typer.testing")
+    page = {"responses": [{"textAnnotations": [{"description": "DEPARTAMENTO Cauca"}, word("DEPARTAMENTO", 100, 100), word("Cauca", 300, 105)]}],
+            "page": 0, "filename": "pdfs/acta.pdf"}
+    (main.output_dir / "acta_0.json").write_text(json.dumps([page]))
+    result = testing.CliRunner().invoke(main.app, ["extract", "--no-docai"])
+    assert result.exit_code == 0, result.output
+    assert "Extracting from 1 saved Vision responses" in result.output
+    (matches_file,) = tmp_path.glob("output-*.jsonl")
+    assert [(m["match_term"], m["match_name"]) for m in map(json.loads, matches_file.read_text().splitlines())] == [("Departamento", "Cauca")]
+    (rows_file,) = tmp_path.glob("output-*.csv")
+    assert rows_file.read_text().splitlines()[1].startswith("acta.pdf,Cauca")
+
+
+def test_docai_batch_needs_a_gcs_uri(main, tmp_path):
+    pytest.importorskip("google.cloud.documentai")
+    testing = pytest.importorskip("typer.testing")
+    # the shipped settings leave docai.gcs_uri blank
+    result = testing.CliRunner().invoke(main.app, ["docai", str(tmp_path), "--batch"])
+    assert result.exit_code == 1
+    assert "needs docai.gcs_uri" in result.output
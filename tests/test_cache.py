@@ -0,0 +1,55 @@
+import os
+from pathlib import Path
+
+from anc_cli.cache import ResponseCache
+
+
+def test_key_depends_on_content_and_options():
+    key = ResponseCache.key(b"page", "DOCUMENT_TEXT_DETECTION", "es")
+    assert key == ResponseCache.key(b"page", "DOCUMENT_TEXT_DETECTION", "es")
+    assert key != ResponseCache.key(b"page", "TEXT_DETECTION", "es")
+    assert key != ResponseCache.key(b"page", "DOCUMENT_TEXT_DETECTION", "en")
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10 ** 9)
+    keys = [ResponseCache.key(str(i).encode()) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, {"text": os.urandom(200).hex()})
+        os.utime(cache.path(key), (i, i))
+    assert cache.get(keys[0]) is not None  # marks the first entry as recently used
+    cache.max_bytes = cache.size - 1
+    cache.put(ResponseCache.key(b"new"), {"text": "x"})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+def test_entry_evicted_after_it_was_read_is_still_returned(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path)
+    key = ResponseCache.key(b"page")
+    cache.put(key, {"text": "x"})
+
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get(key) == {"text": "x"}
+
+
+def test_processes_write_to_their_own_temporary_file(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path)
+    key = ResponseCache.key(b"page")
+    written = []
+    write_bytes = Path.write_bytes
+
+    def record(path, content):
+        written.append(path.name)
+        return write_bytes(path, content)
+
+    monkeypatch.setattr(Path, "write_bytes", record)
+    cache.put(key, {"text": "x"})
+    monkeypatch.setattr(os, "getpid", lambda: 1)
+    cache.put(key, {"text": "y"})
+    assert written[0] != written[1]
+    assert cache.get(key) == {"text": "y"}
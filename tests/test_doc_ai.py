@@ -0,0 +1,232 @@
+import json
+import random
+import threading
+import time
+
+import pytest
+
+documentai = pytest.importorskip("google.cloud.documentai_v1")
+from google.api_core import exceptions
+
+from anc_cli import doc_ai
+from anc_cli.cache import ResponseCache
+
+
+def document(text):
+    """A Document with one table cell holding the whole text"""
+    anchor = documentai.Document.TextAnchor(text_segments=[{"start_index": 0, "end_index": len(text)}])
+    cell = documentai.Document.Page.Table.TableCell(layout={"text_anchor": anchor})
+    table = documentai.Document.Page.Table(body_rows=[{"cells": [cell]}])
+    return documentai.Document(text=text, pages=[{"tables": [table]}])
+
+
+class FakeStorage:
+    def __init__(self):
+        self.blobs = {}
+        storage = self
+
+        class Blob:
+            def __init__(self, bucket, name):
+                self.bucket, self.name = bucket, name
+
+            def upload_from_filename(self, filename, content_type=None):
+                storage.blobs[(self.bucket, self.name)] = open(filename, "rb").read()
+
+            def download_as_bytes(self):
+                return storage.blobs[(self.bucket, self.name)]
+
+        self.Blob = Blob
+
+    def bucket(self, name):
+        storage = self
+
+        class Bucket:
+            def blob(self, blob_name):
+                return storage.Blob(name, blob_name)
+
+        return Bucket()
+
+    def list_blobs(self, bucket, prefix=""):
+        return [self.Blob(b, name) for b, name in sorted(self.blobs) if b == bucket and name.startswith(prefix)]
+
+
+class FakeProcessor:
+    """Stand-in for DocumentProcessorServiceClient, the text of each PDF is its content"""
+
+    def __init__(self, storage=None, fail_first=0):
+        self.storage = storage
+        self.fail_first = fail_first
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def process_document(self, request, timeout=None):
+        with self.lock:
+            self.calls += 1
+            if self.fail_first:
+                self.fail_first -= 1
+                raise exceptions.ServiceUnavailable("try again")
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(random.uniform(0, 0.02))
+        with self.lock:
+            self.in_flight -= 1
+        return documentai.ProcessResponse(document=document(request.raw_document.content.decode()))
+
+    def batch_process_documents(self, request, timeout=None):
+        self.calls += 1
+        output = request.document_output_config.gcs_output_config.gcs_uri
+        statuses = []
+        for i, gcs_document in enumerate(request.input_documents.gcs_documents.documents):
+            bucket, name = doc_ai.split_gcs_uri(gcs_document.gcs_uri)
+            text = self.storage.blobs[(bucket, name)].decode()
+            destination = f"{output}{self.calls}/{i}"
+            out_bucket, out_prefix = doc_ai.split_gcs_uri(destination)
+            # two shards, each with its own text
+            for shard_index, shard_text in enumerate([text, " (cont.)"]):
+                shard = document(shard_text)
+                shard.shard_info = {"shard_index": shard_index, "shard_count": 2}
+                self.storage.blobs[(out_bucket, f"{out_prefix}/doc-{shard_index}.json")] = documentai.Document.to_json(shard).encode()
+            statuses.append({"input_gcs_source": gcs_document.gcs_uri, "output_gcs_destination": destination})
+
+        processor = self
+
+        class Operation:
+            metadata = documentai.BatchProcessMetadata(individual_process_statuses=statuses)
+
+            def result(self, timeout=None):
+                processor.result_timeout = timeout
+
+        return Operation()
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    paths = []
+    for i in range(12):
+        path = tmp_path / f"acta_{i}.pdf"
+        path.write_bytes(f"DEPARTAMENTO {i}".encode())
+        paths.append(path)
+    return paths
+
+
+def test_process_keeps_order_and_bounds_concurrency(pdfs):
+    client = FakeProcessor(fail_first=2)
+    submitter = doc_ai.DocAISubmitter(client, "processor", max_in_flight=3, backoff=0)
+    results = list(submitter.process(pdfs))
+    submitter.close()
+    assert [path for path, documents in results] == pdfs
+    assert [documents[0].text for path, documents in results] == [f"DEPARTAMENTO {i}" for i in range(12)]
+    assert client.max_in_flight <= 3
+    assert client.calls == 14
+
+
+def test_process_gives_up_after_retries(pdfs):
+    submitter = doc_ai.DocAISubmitter(FakeProcessor(fail_first=10), "processor", retries=2, backoff=0)
+    with pytest.raises(exceptions.ServiceUnavailable):
+        submitter.process_file(pdfs[0])
+
+
+def test_cached_documents_are_not_sent_again(tmp_path, pdfs):
+    cache = ResponseCache(tmp_path / "cache")
+    client = FakeProcessor()
+    list(doc_ai.DocAISubmitter(client, "processor", cache=cache).process(pdfs[:4]))
+    second = list(doc_ai.DocAISubmitter(client, "processor", cache=cache).process(pdfs[:4]))
+    assert client.calls == 4
+    assert second[3][1][0].text == "DEPARTAMENTO 3"
+
+
+def test_batch_mode_saves_each_file(tmp_path, pdfs):
+    storage = FakeStorage()
+    client = FakeProcessor(storage)
+    cache = ResponseCache(tmp_path / "cache")
+    submitter = doc_ai.DocAISubmitter(client, "processor", cache=cache)
+    results = list(submitter.batch_process(pdfs, storage, "gs://bucket/anc", batch_size=5))
+    assert client.calls == 3
+    assert [path for path, documents in results] == pdfs
+    save_path = tmp_path / "anc_data"
+    save_path.mkdir()
+    data = doc_ai.save_document(str(pdfs[7]), results[7][1], save_path)
+    assert data["text"] == "DEPARTAMENTO 7 (cont.)"
+    assert data["items"] == [[["DEPARTAMENTO 7"]], [["(cont.)"]]]
+    assert json.loads((save_path / "acta_7_tables.json").read_text())["items"] == data["items"]
+    # shards are cached together
+    again = list(doc_ai.DocAISubmitter(client, "processor", cache=cache).batch_process(pdfs, storage, "gs://bucket/anc"))
+    assert client.calls == 3
+    assert [d.text for d in again[7][1]] == ["DEPARTAMENTO 7", " (cont.)"]
+
+
+def test_batch_of_more_than_ten_keeps_each_files_shards(pdfs):
+    storage = FakeStorage()
+    client = FakeProcessor(storage)
+    submitter = doc_ai.DocAISubmitter(client, "processor", timeout=1, batch_timeout=600)
+    results = list(submitter.batch_process(pdfs, storage, "gs://bucket/anc", batch_size=12))
+    assert client.calls == 1
+    # the outputs of documents 10 and 11 are not read as shards of document 1
+    assert [[d.text for d in documents] for path, documents in results] == [[f"DEPARTAMENTO {i}", " (cont.)"] for i in range(12)]
+    assert client.result_timeout == 600
+
+
+def test_split_gcs_uri():
+    assert doc_ai.split_gcs_uri("gs://bucket/anc/") == ("bucket", "anc")
+    assert doc_ai.split_gcs_uri("gs://bucket") == ("bucket", "")
+    for uri in [None, "", "bucket/anc", "s3://bucket/anc", "gs:///anc"]:
+        with pytest.raises(ValueError):
+            doc_ai.split_gcs_uri(uri)
+
+
+def test_adjacent_cells_follow_rows_then_columns():
+    tables = [
+        [["DEPARTAMENTO", "", "Cauca"], ["MUNICIPIO", "Popayán", "Fecha"]],
+        [["Proponente", "Municipio"], ["Juan", "Cali"]],
+    ]
+    assert list(doc_ai.adjacent_cells(tables)) == [
+        ("DEPARTAMENTO", "Cauca", "MUNICIPIO"),
+        ("Cauca", None, "Fecha"),
+        ("MUNICIPIO", "Popayán", None),
+        ("Popayán", "Fecha", None),
+        ("Fecha", None, None),
+        ("Proponente", "Municipio", "Juan"),
+        ("Municipio", None, "Cali"),
+        ("Juan", "Cali", None),
+        ("Cali", None, None),
+    ]
+
+
+def test_process_data_pairs_labels_with_places(tmp_path, monkeypatch):
+    pytest.importorskip("spaczz")
+    from anc_cli.matchers import MatcherRegistry
+
+    monkeypatch.setattr(doc_ai, "save_dir", lambda: tmp_path)
+    registry = MatcherRegistry("es", ["departamento", "municipio"], 85)
+    data = [
+        {"file": "pdfs/a.pdf", "items": [[["DEPARTAMENTO", "Cauca"], ["MUNICIPIO", "fecha"]]]},
+        {"file": "pdfs/b.pdf", "items": [[["Municipio", "Departamento"], ["Popayán", "Cauca"]]]},
+    ]
+    result = doc_ai.process_data(data, registry)
+    assert result == [
+        {"file": "pdfs/a.pdf", "departamento": "cauca", "municipio": []},
+        {"file": "pdfs/b.pdf", "departamento": "cauca", "municipio": "popayán"},
+    ]
+    assert (tmp_path / "b.csv").read_text().splitlines()[0] == "file,departamento,municipio"
+
+
+def test_saved_tables_give_the_same_rows(tmp_path, monkeypatch):
+    pytest.importorskip("spaczz")
+    from anc_cli.matchers import MatcherRegistry
+
+    monkeypatch.setattr(doc_ai, "save_dir", lambda: tmp_path)
+    text = "DEPARTAMENTO Cauca MUNICIPIO Popayán"
+    cells = []
+    for start, end in [(0, 12), (13, 18), (19, 28), (29, 36)]:
+        anchor = documentai.Document.TextAnchor(text_segments=[{"start_index": start, "end_index": end}])
+        cells.append(documentai.Document.Page.Table.TableCell(layout={"text_anchor": anchor}))
+    table = documentai.Document.Page.Table(body_rows=[{"cells": cells[:2]}, {"cells": cells[2:]}])
+    registry = MatcherRegistry("es", ["departamento", "municipio"], 85)
+    data = doc_ai.save_document("pdfs/acta.pdf", [documentai.Document(text=text, pages=[{"tables": [table]}])], tmp_path)
+    saved = doc_ai.load_saved_data(tmp_path)
+    assert saved == [dict(file="pdfs/acta.pdf", items=data["items"], text=text)]
+    rows = doc_ai.process_data([data], registry)
+    assert rows == [{"file": "pdfs/acta.pdf", "departamento": "cauca", "municipio": "popayán"}]
+    assert doc_ai.process_data(saved, registry) == rows
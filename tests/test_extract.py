@@ -0,0 +1,58 @@
+import csv
+
+import pytest
+
+from anc_cli import extract
+
+from .conftest import word
+
+
+def test_chunked():
+    assert list(extract.chunked(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_row_writer_writes_one_row_per_file(tmp_path):
+    path = tmp_path / "output.csv"
+    rows = extract.RowWriter(str(path), ["departamento", "municipio"])
+    rows.add(dict(match_term="Departamento", match_name="Cauca", filename="pdfs/a.pdf", page=0, ratio=90))
+    rows.add(dict(match_term="Departamento", match_name="Huila", filename="pdfs/a.pdf", page=1, ratio=100))
+    rows.add(dict(match_term="Departamento", match_name="Cauca", filename="pdfs/a.pdf", page=2, ratio=88))
+    rows.add(dict(match_term="Municipio", match_name="Popayán", filename="pdfs/a.pdf", page=1, ratio=100))
+    rows.add(dict(match_term="Municipio", match_name="Cali", filename="pdfs/b.pdf", page=0, ratio=95))
+    # the first file's row is written as soon as the second file starts
+    assert len(path.read_text().splitlines()) == 2
+    rows.close()
+    with open(path) as f:
+        assert list(csv.DictReader(f)) == [
+            {
+                "filename": "a.pdf",
+                "departamento": "Cauca",
+                "municipio": "Popayán",
+                "departamento_candidates": "Huila (100, p. 1); Cauca (90, p. 0 2)",
+                "municipio_candidates": "Popayán (100, p. 1)",
+            },
+            {
+                "filename": "b.pdf",
+                "departamento": "",
+                "municipio": "Cali",
+                "departamento_candidates": "",
+                "municipio_candidates": "Cali (95, p. 0)",
+            },
+        ]
+
+
+def test_parallel_extraction_matches_serial(tmp_path):
+    pytest.importorskip("spaczz")
+    srsly = pytest.importorskip("srsly")
+    from anc_cli.matchers import MatcherRegistry
+
+    paths = []
+    for i, (label, value) in enumerate([("DEPARTAMENTO", "Cauca"), ("MUNICIPIO", "Popayán"), ("FECHA", "hoy")]):
+        words = [word(label, 100, 100), word(value, 300, 105)]
+        page = {"responses": [{"textAnnotations": [{"description": f"{label} {value}"}] + words}], "page": 0, "filename": f"{i}.pdf"}
+        paths.append(tmp_path / f"{i}_0.json")
+        srsly.write_json(paths[-1], [page])
+    registry = MatcherRegistry("es", ["departamento", "municipio"], 85)
+    serial = list(extract.extract_files(paths, registry))
+    assert serial == list(extract.extract_files(paths, registry, workers=2))
+    assert [m["match_name"] for path, matches in serial for m in matches] == ["Cauca", "Popayán"]
@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+spacy = pytest.importorskip("spacy")
+from anc_cli import gazetteer
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(gazetteer, "cache_dir", tmp_path)
+    return tmp_path
+
+
+def test_gazetteer_is_cached_on_disk(cache_dir):
+    nlp = spacy.blank("es")
+    first = gazetteer.load_gazetteer(nlp, ["departamento"])
+    assert len(list(cache_dir.glob("gazetteer-*.msgpack"))) == 1
+    second = gazetteer.load_gazetteer(nlp, ["departamento"])
+    assert first["key"] == second["key"]
+    assert second["labels"][-1] == "term_DEPARTAMENTO"
+
+
+def test_truncated_cache_is_rebuilt(cache_dir):
+    nlp = spacy.blank("es")
+    first = gazetteer.load_gazetteer(nlp, ["departamento"])
+    (cache_file,) = cache_dir.glob("gazetteer-*.msgpack")
+    old = cache_dir / "gazetteer-v1-0123456789abcdef.msgpack"
+    old.write_bytes(b"")
+    cache_file.write_bytes(cache_file.read_bytes()[:100])
+    assert gazetteer.load_gazetteer(nlp, ["departamento"])["labels"] == first["labels"]
+    assert list(cache_dir.glob("gazetteer-*")) == [cache_file]
+    assert gazetteer.load_gazetteer(nlp, ["departamento"])["key"] == first["key"]
+
+
+def test_each_term_list_has_its_own_cache(cache_dir):
+    gazetteer.load_gazetteer(spacy.blank("es"), ["departamento"])
+    nlp, term_matcher, place_matcher = gazetteer.load_matchers("es", ["municipio"])
+    assert [m[0] for m in term_matcher(nlp("MUNICIPIO"))] == ["MUNICIPIO"]
+    assert term_matcher(nlp("DEPARTAMENTO")) == []
+    assert len(list(cache_dir.glob("gazetteer-*.msgpack"))) == 2
+    # the same terms in another order, or another language, are told apart too
+    key = gazetteer.gazetteer_key(spacy.blank("es"), ["departamento", "municipio"])
+    assert key == gazetteer.gazetteer_key(spacy.blank("es"), ["municipio", "departamento"])
+    assert key != gazetteer.gazetteer_key(spacy.blank("en"), ["departamento", "municipio"])
+
+
+def test_load_matchers(cache_dir):
+    nlp, term_matcher, place_matcher = gazetteer.load_matchers("es", ["departamento", "municipio"])
+    matches = place_matcher(nlp("Popayán"))
+    assert ("municipio_popayán", 0, 1, 100) in [tuple(m[:4]) for m in matches]
+    assert [m[0] for m in term_matcher(nlp("MUNICIPIO"))] == ["MUNICIPIO"]
+
+
+def test_place_resolver():
+    resolver = gazetteer.PlaceResolver(["municipio_popayán", "municipio_cali", "municipio_cali", "departamento_valle del cauca", "departamento_cauca"])
+    assert gazetteer.normalize(" POPAYÁN ") == "popayan"
+    assert resolver.labels == ["municipio_popayán", "municipio_cali", "departamento_valle del cauca", "departamento_cauca"]
+    # ratio as place_matcher computes it, on the lower cased names
+    assert resolver.lookup("Popayan") == [("municipio_popayán", 86)]
+    assert resolver.lookup("VALLE DEL CAUCA")[0] == ("departamento_valle del cauca", 100)
+    assert resolver.lookup("Popayám")[0][0] == "municipio_popayán"
+    assert resolver.lookup("Bogotá") == []
+    nlp = spacy.blank("es")
+    assert resolver(nlp("de Cauca")) == [("departamento_cauca", 1, 2, 100, "cauca")]
+    # one match per label, the listed name only once
+    assert [m[:4] for m in resolver(nlp("Cali, Cali"))] == [("municipio_cali", 0, 1, 100), ("municipio_cali", 2, 3, 100)]
+
+
+def test_place_resolver_matches_place_matcher(cache_dir):
+    # noisy place names, alone and between other words, against the real gazetteer
+    from anc_cli.matchers import MatcherRegistry
+
+    fuzzy = MatcherRegistry("es", ["departamento"], 85, place_lookup="fuzzy")
+    tiered = MatcherRegistry("es", ["departamento"], 85, place_lookup="tiered")
+    names = [label.split("_", 1)[1] for label in tiered.resolver.labels]
+    rng = random.Random(0)
+    confusions = {"a": "o", "e": "c", "i": "l", "l": "1", "o": "0", "r": "n", "s": "5", "u": "v"}
+    texts = ["DEPARTAMENTO Bolívar MUNICIPIO Cali", "cra matías de"]
+    for _ in range(300):
+        name = "".join(confusions.get(c, c) if rng.random() < 0.15 else c for c in rng.choice(names))
+        name = rng.choice([name, name.upper(), name.title()])
+        texts.append(rng.choice([name, f"de {name} No.", f"FECHA {name}, {rng.choice(names)}"]))
+    docs = fuzzy.docs(texts)
+    for text in texts:
+        assert tiered.find_places(docs[text]) == fuzzy.find_places(docs[text]), text
+
+
+def test_municipios_of_departamento():
+    hierarchy = {"cauca": ["popayán", "piendamó"], "valle del cauca": ["cali", "palmira"]}
+    labels = ["municipio_popayán", "municipio_piendamó", "municipio_cali", "municipio_palmira", "departamento_cauca", "departamento_valle del cauca"]
+    resolver = gazetteer.PlaceResolver(labels, hierarchy=hierarchy)
+    cauca = resolver.for_departamento("Cauca")
+    assert cauca.labels == ["municipio_popayán", "municipio_piendamó"]
+    assert cauca.lookup("Cali") == []
+    assert resolver.for_departamento("VALLE DEL CAUCA").lookup("Cali") == [("municipio_cali", 100)]
+    assert resolver.for_departamento("Amazonas") is None
+
+
+def test_hierarchy_covers_gazetteer():
+    import srsly
+    municipios = set(srsly.read_json(gazetteer.municipios_path))
+    departamentos = set(srsly.read_json(gazetteer.departamentos_path))
+    for entry in srsly.read_json(gazetteer.hierarchy_path):
+        assert entry["departamento"] in departamentos
+        assert set(entry["municipios"]) <= municipios
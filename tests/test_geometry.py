@@ -0,0 +1,50 @@
+import pytest
+
+from .conftest import box
+
+pytest.importorskip("numpy")
+from anc_cli import geometry
+
+
+def paragraph(text, x, y):
+    return {"boundingBox": box(x, y), "words": [{"symbols": [{"text": c} for c in word]} for word in text.split()]}
+
+
+def response():
+    blocks = [
+        {"paragraphs": [paragraph("DEPARTAMENTO", 100, 100), paragraph("Valle del Cauca", 300, 105)]},
+        {"paragraphs": [paragraph("MUNICIPIO", 100, 300), paragraph("Cali", 300, 310)]},
+    ]
+    words = [("DEPARTAMENTO", 100, 100), ("Valle", 300, 105), ("del", 420, 105), ("Cauca", 540, 105), ("MUNICIPIO", 100, 300), ("Cali", 300, 310)]
+    annotations = [{"description": "DEPARTAMENTO Valle del Cauca\nMUNICIPIO Cali"}]
+    annotations += [{"description": text, "boundingPoly": box(x, y)} for text, x, y in words]
+    return {"responses": [{"textAnnotations": annotations, "fullTextAnnotation": {"pages": [{"blocks": blocks}]}}], "page": 0, "filename": "test.pdf"}
+
+
+def test_words_are_loaded_once_into_arrays():
+    page = geometry.PageGeometry.from_words(response())
+    assert len(page) == 6
+    assert page.x.shape == (6, 4) and page.x.dtype.name == "int32"
+    assert page.ids.tolist() == [1, 2, 3, 4, 5, 6]
+    assert page.offsets.tolist() == [0, 13, 19, 23, 29, 39]
+    # Valle del Cauca is one paragraph, Cali is in the second block
+    assert page.paragraph.tolist() == [0, 1, 1, 1, 2, 3]
+    assert page.block.tolist() == [0, 0, 0, 0, 1, 1]
+
+
+def test_queries():
+    page = geometry.PageGeometry.from_words(response())
+    assert page.right_of(200, 100, 195) == [2, 3, 4]
+    assert page.below(200) == [5, 6]
+    assert page.below(100, min_x=200) == [2, 3, 4, 6]
+    assert page.within_band(290, 320) == [5, 6]
+    assert page.nearest(290, 300) == 6
+    assert page.nearest(290, 300, ids=[2, 5]) == 5
+    assert page.nearest(0, 0, ids=[]) is None
+
+
+def test_paragraphs():
+    paragraphs = geometry.PageGeometry.from_paragraphs(response()["responses"][0])
+    assert paragraphs.texts == ["DEPARTAMENTO ", "Valle del Cauca ", "MUNICIPIO ", "Cali "]
+    assert paragraphs.block.tolist() == [0, 0, 1, 1]
+    assert paragraphs.right.tolist() == [200, 400, 200, 400]
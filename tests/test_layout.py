@@ -0,0 +1,42 @@
+import pytest
+
+from .conftest import box, symbols_word as word
+
+pytest.importorskip("numpy")
+from anc_cli import layout
+
+
+def paragraph(words, x, y):
+    return {"boundingBox": box(x, y), "words": words}
+
+
+def response():
+    # Vision lists the Cali paragraph before the label it belongs to
+    blocks = [
+        {"boundingBox": box(300, 300), "paragraphs": [paragraph([word("Cali", 300, 310)], 300, 310)]},
+        {"boundingBox": box(100, 100, 400), "paragraphs": [
+            paragraph([word("DEPARTAMENTO:", 100, 100)], 100, 100),
+            paragraph([word("Valle", 300, 105, "EOL_SURE_SPACE"), word("del", 300, 130), word("Cauca", 340, 130)], 300, 105),
+        ]},
+        {"boundingBox": box(100, 300), "paragraphs": [paragraph([word("Municipio", 100, 300)], 100, 300)]},
+    ]
+    return {"responses": [{"fullTextAnnotation": {"pages": [{"width": 800, "height": 600, "blocks": blocks}]}}]}
+
+
+def test_lines_and_paragraphs_are_built_once():
+    page = layout.PageLayout(response())
+    assert page.paragraphs.texts == ["Cali ", "DEPARTAMENTO: ", "Valle del Cauca ", "Municipio "]
+    assert page.lines.texts == ["Cali", "DEPARTAMENTO:", "Valle", "del Cauca", "Municipio"]
+    assert page.lines.paragraph.tolist() == [0, 1, 2, 2, 3]
+    assert [rows for b, rows in page.blocks] == [[0], [1, 2, 3], [4]]
+    assert page.lines.right.tolist()[3] == 390
+    # reading order: top to bottom, then left to right
+    assert page.order.tolist() == [1, 2, 3, 0]
+
+
+def test_next_fields_for_all_labels():
+    page = layout.PageLayout(response())
+    fields = page.next_fields(["departamen", "municip", "dep.int"])
+    # Cali comes first in Vision order, but Valle del Cauca is next in reading order
+    assert fields == {"departamen": "Valle del Cauca ", "municip": "Cali ", "dep.int": None}
+    assert page.find(["municip", "departamen"]) == {"departamen": 1, "municip": 3}
@@ -0,0 +1,37 @@
+import warnings
+
+import pytest
+
+pytest.importorskip("spaczz")
+from anc_cli.matchers import MatcherRegistry
+
+
+def test_registry_loads_lazily_and_classifies_in_bulk():
+    registry = MatcherRegistry("es", ["departamento", "municipio"], 85)
+    assert registry._loaded is None
+    results = registry.classify(["DEPARTAMENTO Cauca", "nada que ver", "MUNICIPIO de Popayán"])
+    assert [terms for doc, terms in results] == [["DEPARTAMENTO"], [], ["MUNICIPIO"]]
+    assert registry.nlp.vocab is registry.place_matcher.vocab
+
+
+def test_docs_tokenizes_each_text_once():
+    registry = MatcherRegistry("es", ["departamento"], 85)
+    docs = registry.docs(["Cauca", "Valle del Cauca", "Cauca"])
+    cauca = docs["Cauca"]
+    assert len(docs["Valle del Cauca"]) == 3
+    assert registry.docs(["Cauca"])["Cauca"] is cauca
+    assert registry.doc("Cauca") is cauca
+
+
+def test_find_municipios_within_departamento():
+    tiered = MatcherRegistry("es", ["departamento"], 85)
+    fuzzy = MatcherRegistry("es", ["departamento"], 85, place_lookup="fuzzy")
+    doc = tiered.doc("Cali")
+    assert "municipio_cali" in [m[0] for m in tiered.find_municipios(doc)]
+    assert "municipio_cali" not in [m[0] for m in tiered.find_municipios(doc, "Cauca")]
+    # fuzzy can't constrain the lookup, it says so once
+    with pytest.warns(UserWarning, match="place_lookup fuzzy"):
+        assert fuzzy.find_municipios(doc, "Cauca") == fuzzy.find_places(doc)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        fuzzy.find_municipios(doc, "Cauca")
@@ -0,0 +1,107 @@
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from anc_cli.cache import ResponseCache
+from anc_cli.ocr import VisionClient, VisionError
+
+
+class FakeVision(BaseHTTPRequestHandler):
+    """Stand-in for images:annotate, the text of each image is its decoded content"""
+    protocol_version = "HTTP/1.1"
+    fail_first = 0
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        cls.requests += 1
+        if cls.fail_first:
+            cls.fail_first -= 1
+            self.reply(503, {"error": {"code": 503}})
+            return
+        time.sleep(random.uniform(0, 0.02))
+        responses = []
+        for request in body["requests"]:
+            text = base64.b64decode(request["image"]["content"]).decode()
+            responses.append({"textAnnotations": [{"description": text}]})
+        self.reply(200, {"responses": responses})
+
+    def reply(self, status, payload):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    FakeVision.fail_first = 0
+    FakeVision.requests = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVision)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1/images:annotate"
+    server.shutdown()
+
+
+def test_annotate_images_keeps_page_order(endpoint):
+    client = VisionClient("key", endpoint=endpoint, max_in_flight=4)
+    images = (f"page {i}".encode() for i in range(20))
+    texts = [r["responses"][0]["textAnnotations"][0]["description"] for r in client.annotate_images(images, "es")]
+    assert texts == [f"page {i}" for i in range(20)]
+
+
+def test_annotate_retries_with_backoff(endpoint):
+    FakeVision.fail_first = 2
+    client = VisionClient("key", endpoint=endpoint, retries=3, backoff=0.01)
+    [response] = client.annotate_images([b"hola"], "es")
+    assert response["responses"][0]["textAnnotations"][0]["description"] == "hola"
+    assert FakeVision.requests == 3
+
+
+def test_annotate_gives_up_after_retries(endpoint):
+    FakeVision.fail_first = 5
+    client = VisionClient("key", endpoint=endpoint, retries=1, backoff=0.01)
+    with pytest.raises(VisionError):
+        list(client.annotate_images([b"hola"], "es"))
+
+
+def test_pages_are_batched_into_requests(endpoint):
+    client = VisionClient("key", endpoint=endpoint, batch_size=4)
+    images = [f"page {i}".encode() for i in range(10)]
+    responses = list(client.annotate_images(images, "es"))
+    assert FakeVision.requests == 3
+    assert [r["responses"][0]["textAnnotations"][0]["description"] for r in responses] == [f"page {i}" for i in range(10)]
+
+
+def test_batches_respect_payload_limit():
+    client = VisionClient("key", batch_size=16, max_payload_bytes=100)
+    batches = list(client.batches([b"x" * 60] * 3 + [b"y"] * 5, "es", "DOCUMENT_TEXT_DETECTION"))
+    assert [len(b) for b in batches] == [1, 1, 6]
+
+
+def test_cached_pages_are_not_sent_again(endpoint, tmp_path):
+    cache = ResponseCache(tmp_path)
+    images = [f"page {i}".encode() for i in range(6)]
+    client = VisionClient("key", endpoint=endpoint, batch_size=4, cache=cache)
+    first = list(client.annotate_images(images[:3], "es"))
+    assert FakeVision.requests == 1
+    second = list(client.annotate_images(images, "es"))
+    assert FakeVision.requests == 2
+    assert second[:3] == first
+    assert [r["responses"][0]["textAnnotations"][0]["description"] for r in second] == [f"page {i}" for i in range(6)]
+
+    forced = VisionClient("key", endpoint=endpoint, cache=cache, force=True)
+    list(forced.annotate_images(images[:1], "es"))
+    assert FakeVision.requests == 3
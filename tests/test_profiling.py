@@ -0,0 +1,91 @@
+import csv
+import json
+import pstats
+
+import pytest
+
+from anc_cli import profiling
+
+from .conftest import word
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    # the module stats, enabled for one test and disabled again afterwards
+    stats = profiling.Stats()
+    monkeypatch.setattr(profiling, "stats", stats)
+    stats.enable()
+    return stats
+
+
+def test_nothing_is_recorded_until_enabled():
+    stats = profiling.Stats()
+    with stats.stage("matching"):
+        stats.count("pages")
+    assert stats.stages == {} and stats.counters == {}
+
+
+def test_stages_and_counters(stats):
+    for _ in range(3):
+        with stats.stage("matching"):
+            with stats.stage("matching.places"):
+                sum(range(10000))
+    stats.count("pages", 2)
+    stats.count("pages")
+    with pytest.raises(ValueError):
+        with stats.stage("save"):
+            raise ValueError
+    report = stats.report()
+    stages = {stage["stage"]: stage for stage in report["stages"]}
+    assert [stages[name]["calls"] for name in ["matching", "matching.places", "save"]] == [3, 3, 1]
+    assert stages["matching"]["wall_s"] >= stages["matching.places"]["wall_s"] > 0
+    assert report["counters"] == {"pages": 3}
+    assert report["throughput"]["pages_per_s"] > 0
+
+
+def test_merge_adds_a_worker_snapshot(stats):
+    worker = profiling.Stats()
+    worker.enable()
+    with worker.stage("matching"):
+        pass
+    worker.count("matches", 5)
+    with stats.stage("matching"):
+        pass
+    stats.count("matches", 1)
+    stats.merge(worker.snapshot())
+    assert stats.stages["matching"]["calls"] == 2
+    assert stats.counters == {"matches": 6}
+    assert worker.stages == {} and worker.counters == {}
+
+
+def test_write_report(stats, tmp_path):
+    stats.profile("matching")
+    with stats.stage("matching"):
+        sorted(range(1000), key=str)
+    stats.count("matches", 4)
+    paths = stats.write(tmp_path / "profile-process")
+    assert [path.name for path in paths] == ["profile-process.json", "profile-process.csv", "profile-process-matching.prof"]
+    report = json.loads(paths[0].read_text())
+    assert report["stages"][0]["stage"] == "matching" and report["counters"] == {"matches": 4}
+    with open(paths[1]) as f:
+        rows = list(csv.DictReader(f))
+    assert [row["stage"] for row in rows] == ["matching", "count.matches"]
+    assert rows[1]["calls"] == "4"
+    assert pstats.Stats(str(paths[2])).total_calls > 0
+
+
+def test_worker_stages_are_merged(stats, tmp_path, monkeypatch):
+    pytest.importorskip("spaczz")
+    srsly = pytest.importorskip("srsly")
+    from anc_cli import extract
+    from anc_cli.matchers import MatcherRegistry
+
+    monkeypatch.setattr(extract, "stats", stats)
+    page = {"responses": [{"textAnnotations": [{"description": "FECHA hoy"}, word("FECHA", 100, 100)]}], "page": 0, "filename": "a.pdf"}
+    paths = [tmp_path / f"a_{i}.json" for i in range(2)]
+    for path in paths:
+        srsly.write_json(path, [page])
+    registry = MatcherRegistry("es", ["departamento", "municipio"], 85)
+    list(extract.extract_files(paths, registry, workers=2))
+    assert stats.stages["matching"]["calls"] == 2
+    assert stats.counters["pages_extracted"] == 2
@@ -0,0 +1,45 @@
+import pytest
+
+from .conftest import word
+
+pytest.importorskip("numpy")
+from anc_cli import store, utils
+
+
+def forms():
+    words = [word("DEPARTAMENTO", 0, 100), word("Cauca", 300, 105), word("MUNICIPIO", 100, 300), word("Popayán", 300, 310)]
+    page = {"responses": [{"textAnnotations": [{"description": "DEPARTAMENTO Cauca\nMUNICIPIO Popayán", "locale": "es"}] + words}], "page": 0, "filename": "a.pdf"}
+    blank = {"responses": [{}], "page": 1, "filename": "a.pdf"}
+    return [page, blank]
+
+
+def test_compact_round_trip(tmp_path):
+    meta_path = store.write_compact(tmp_path / "a_0", forms())
+    assert meta_path.name == "a_0.meta.msgpack.gz"
+    assert store.response_stem(meta_path) == "a_0"
+    assert store.saved_response_files(tmp_path) == [meta_path]
+    pages = store.read_responses(meta_path)
+    assert len(pages) == 2
+    assert pages.coords.dtype.name == "int16"
+    assert pages[1] == {"responses": [{}], "page": 1, "filename": "a.pdf"}
+    original = forms()[0]
+    for term in ["departamento", "municipio"]:
+        assert utils.get_data(pages[0], term, 2) == utils.get_data(original, term, 2)
+    assert pages.geometry(0).right_of(200, 290, 395) == [4]
+    store.remove_responses(meta_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_compact_file_is_preferred_to_its_json(tmp_path):
+    srsly = pytest.importorskip("srsly")
+    srsly.write_json(tmp_path / "a_0.json", forms())
+    meta_path = store.write_compact(tmp_path / "a_0", forms())
+    srsly.write_json(tmp_path / "b_1.json", forms())
+    assert store.saved_response_files(tmp_path) == [meta_path, tmp_path / "b_1.json"]
+
+
+def test_word_index_from_stored_geometry(tmp_path):
+    pages = store.read_responses(store.write_compact(tmp_path / "a_0", forms()))
+    index = utils.WordIndex(pages.text_page(0), pages.geometry(0))
+    assert utils.get_data_for_terms(pages.text_page(0), ["departamento", "municipio"], 2, index) == \
+        utils.get_data_for_terms(forms()[0], ["departamento", "municipio"], 2)
@@ -0,0 +1,96 @@
+import io
+import threading
+
+import pytest
+
+from anc_cli import utils
+
+from .conftest import word
+
+
+def form(*words):
+    annotations = [{"description": " ".join(w["description"] for w in words)}] + list(words)
+    return {"responses": [{"textAnnotations": annotations}], "page": 0, "filename": "test.pdf"}
+
+
+def test_get_data_finds_value_right_of_label():
+    page = form(
+        word("DEPARTAMENTO", 100, 100),
+        word("Cauca", 300, 105),
+        word("Popayán", 300, 400),
+        word("Fecha", 50, 110),
+    )
+    results = utils.get_data(page, "departamento", 2)
+    assert [r["value"] for r in results] == ["Cauca"]
+    assert results[0]["prior_word"] == "DEPARTAMENTO"
+    assert results[0]["next_word"] == "Popayán"
+
+
+def test_word_index_is_shared_across_terms():
+    page = form(
+        word("DEPARTAMENTO", 100, 100),
+        word("Cauca", 300, 105),
+        word("MUNICIPIO", 100, 300),
+        word("Popayán", 300, 310),
+    )
+    index = utils.WordIndex(page)
+    assert [r["value"] for r in utils.get_data(page, "departamento", 2, index)] == ["Cauca"]
+    assert [r["value"] for r in utils.get_data(page, "municipio", 2, index)] == ["Popayán"]
+
+
+def test_get_data_for_terms_matches_get_data():
+    page = form(
+        word("DEPARTAMENTO", 100, 100),
+        word("Cauca", 300, 105),
+        word("MUNICIPI0", 100, 300),
+        word("Popayán", 300, 310),
+        word("Fecha", 300, 600),
+    )
+    terms = ["departamento", "municipio", "proponente"]
+    results = utils.get_data_for_terms(page, terms, 2)
+    assert results == {term: utils.get_data(page, term, 2) for term in terms}
+    assert [r["value"] for r in results["municipio"]] == ["Popayán"]
+    assert results["proponente"] == []
+
+
+def test_prefetch_keeps_order_and_raises():
+    assert list(utils.prefetch(iter(range(50)), 4)) == list(range(50))
+
+    def failing():
+        yield 1
+        raise ValueError("bad page")
+
+    items = utils.prefetch(failing(), 2)
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_prefetch_stops_when_the_consumer_does():
+    produced = []
+
+    def pages():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    running = set(threading.enumerate())
+    items = utils.prefetch(pages(), 2)
+    assert next(items) == 0
+    (producer,) = set(threading.enumerate()) - running
+    items.close()
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert len(produced) < 10
+
+
+def test_encode_image():
+    Image = pytest.importorskip("PIL.Image")
+    image = Image.new("RGB", (1700, 2200), "white")
+    ppm = io.BytesIO()
+    image.save(ppm, format="PPM")
+    jpeg = utils.encode_image(image, format="JPEG", quality=85)
+    png = utils.encode_image(image, format="PNG", binarize=True, max_dimension=1000)
+    assert len(jpeg) < len(ppm.getvalue())
+    assert Image.open(io.BytesIO(jpeg)).format == "JPEG"
+    assert Image.open(io.BytesIO(png)).size[1] == 1000